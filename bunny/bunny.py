@@ -11,8 +11,11 @@ import time
 import itertools
 import sympy
 from collections import OrderedDict
+from fractions import Fraction
 from copy import deepcopy
 
+import vectorized as _vectorized
+
 ####################################EXCEPTIONS#################################
 class ArgError(Exception):
     """
@@ -32,56 +35,65 @@ class UndefError(Exception): pass
 
 class InconsistentBindingError(Exception): pass
     
-#######################DECORATORS############################################
-def memo(f):
-    """Decorator that caches the return value for each call to f(args).
-    Then when called again with same args, we can just look it up."""
-    cache = {}
-    def _f(*args):
-        try:
-            return cache[args]
-        except KeyError:
-            cache[args] = result = f(*args)
-            return result
-        except TypeError:
-            # some element of args can't be a dict key
-            return f(*args)
-    _f.__name__ = f.__name__
-    return _f
-
 #Constant definition
 #Because of 0*float('inf') := 'nan', I define infinity to be 1000.
 INF = 1000
 
 ###############################################################################
-class Bunny(object):
+class WitnessCache(object):
     '''
-    General Bunny class, superclass for InfBunny
+    Keeps for every identity up to *maxsize* of its recent failing
+    assignments, most recently used first. An assignment failing in one bunny
+    often fails in many others, so Bunny.check_id tries them before the scan.
+    Assignments are keyed on the identity itself (equal identities have equal
+    str), not on its number.
+    Counts hits (identity refuted by a cached assignment) and misses (cached
+    assignments tried, none failing).
     '''
     
-    def __init__(self, f2, f1, f0=0, index=None, size=None):
+    def __init__(self, maxsize=4):
+        self.maxsize = maxsize
+        self.clear()
+        
+    def get(self, id_):
         '''
-        Constructor
+        Return list of cached failing assignments of *id_* as pairs
+        (largest value, dict of values of variables).
         '''
-        self.funcs = dict()
-        self.funcs['f2'] = f2
-        self.funcs['f1'] = f1
-        self.funcs['f0'] = f0
-        if size == None:
-            self.size = len(self.funcs['f1'].dict)
-        else:
-            self.size = size
-        if index == None:
-            if isinstance(self.size, int):
-                self.index = _index(self.funcs['f2'].dict,
-                                    self.funcs['f1'].dict,
-                                    self.funcs['f0'],
-                                    self.size)
-            else:
-                self.index = 'N/A'
-        else:
-            self.index = index
+        return self._witnesses.get(id_, ())
+    
+    def add(self, id_, dict_subs):
+        '''
+        Put failing assignment *dict_subs* of *id_* in front.
+        '''
+        witnesses = self._witnesses.setdefault(id_, [])
+        if witnesses and witnesses[0][1] == dict_subs:
+            return
+        witness = (max(dict_subs.values() or [0]), dict(dict_subs))
+        if witness in witnesses:
+            witnesses.remove(witness)
+        witnesses.insert(0, witness)
+        del witnesses[self.maxsize:]
         
+    def clear(self):
+        self._witnesses = dict()
+        self.hits = self.misses = 0
+        
+    def stats(self):
+        return {'identities': len(self._witnesses), 'maxsize': self.maxsize,
+                'hits': self.hits, 'misses': self.misses}
+
+# Failing assignments of identities in finite bunnies, see Bunny.check_id
+witness_cache = WitnessCache()
+
+class _BunnyBase(object):
+    '''
+    Methods shared by Bunny and CompactBunny, which keep the functions in
+    *funcs*, *size* and *index*. No instance dict, so that CompactBunny is
+    slotted.
+    '''
+    __slots__ = ()
+    
     def __str__(self):
         if not isinstance(self.size, int):
             raise Exception('Size not int')
@@ -90,9 +102,9 @@ class Bunny(object):
         s += ('f2\t' + '\t'.join(map(str, range(size))) +
              '\t\tf1' + '\t\t\tf0' + '\n')
         for i in range(size):
-            f2_vals = (self.funcs['f2'].dict[i, j] for j in range(size))
+            f2_vals = (self.funcs['f2'](i, j) for j in range(size))
             s += (str(i) + '\t' + '\t'.join(map(str, f2_vals)) +
-                  '\t\t' + str(i) + '\t' + str(self.funcs['f1'].dict[i]))
+                  '\t\t' + str(i) + '\t' + str(self.funcs['f1'](i)))
             if i == 0:
                 s += '\t\t\t' + str(self.funcs['f0'])
             s += '\n'
@@ -102,27 +114,50 @@ class Bunny(object):
         s = 'show(index={}, size={})'.format(self.index, self.size)
         return s
     
-    def __eq__(self, other):
-        return ((type(self) == type(other)) and
-                (self.size == other.size) and
-                (self.funcs['f2'].dict == other.funcs['f2'].dict) and
-                (self.funcs['f1'].dict == other.funcs['f1'].dict) and
-                (self.funcs['f0'] == other.funcs['f0']))
+    def tables_key(self):
+        '''
+        Return key equal for finite bunnies with equal tables of functions,
+        made from the tables themselves and not from the given index. Made
+        once per bunny. None if the tables are not complete.
+        '''
+        if getattr(self, '_key', None) is None:
+            size = self.size
+            f2 = self.funcs['f2'].dict
+            f1 = self.funcs['f1'].dict
+            try:
+                self._key = (size, tuple(map(f2.__getitem__, _cells(size))),
+                             tuple(map(f1.__getitem__, xrange(size))),
+                             self.funcs['f0'])
+            except KeyError:
+                self._key = False
+        return self._key or None
     
-    @classmethod
-    def dicts2bunny(cls, f2_dict, f1_dict, f0, index=None, size=None):
-        f2 = _dict2f(f2_dict, 'f2')
-        f1 = _dict2f(f1_dict, 'f1')
-        return cls(f2, f1, f0, index, size)
-
-    def check_id(self, id_, limit=None, v=False):
+    def check_id(self, id_, limit=None, v=False, vectorized=False):
         '''
         check if bunny satisfies id
         
         @param limit: checks up to this limit
+        @param vectorized: evaluate over all the assignments at once with
+        NumPy, only for finite bunnies
         '''
-        if isinstance(self.size, int):
+        finite = isinstance(self.size, int)
+        if finite:
             limit = self.size
+            if vectorized:
+                if getattr(self, '_tables', None) is None:
+                    self._tables = _vectorized.cayley_tables(self)
+                return _vectorized.check_id(self, id_, v, self._tables)
+            if not v:
+                # failing assignments of other bunnies first
+                witnesses = witness_cache.get(id_)
+                for top, dict_subs in witnesses:
+                    if top < limit and (id_.left_term(self, dict_subs) !=
+                                        id_.right_term(self, dict_subs)):
+                        witness_cache.hits += 1
+                        witness_cache.add(id_, dict_subs)
+                        return False
+                if witnesses:
+                    witness_cache.misses += 1
         assert limit != None and limit != float('inf')
         
         current_vars = id_.var_symbols
@@ -133,43 +168,477 @@ class Bunny(object):
             lhs = id_.left_term(self, dict_subs)
             rhs = id_.right_term(self, dict_subs) 
             if not lhs == rhs:
+                if finite:
+                    witness_cache.add(id_, dict_subs)
                 if v:
                     return False, dict_subs, lhs, rhs
                 else:
                     return False
         return True
-        
-def bunnies(size):
+
+class Bunny(_BunnyBase):
     '''
-    Create iterator over all finite bunnies on the domain of given size.
+    General Bunny class, superclass for InfBunny
     '''
-    all_f = ((dict([[(i, j), (v2 / (size ** (i + size*j)) % size)]
-                     for i in range(size)
-                     for j in range(size)]),
-              
-              dict([[i, (v1 / size**i % size)]
-                     for i in range(size)]),
-              
-              v0,
-              
-              v2 + v1*(size ** (size**2)) + v0*(size ** (size**2 + size)))
-             
-             for v2 in xrange(size ** (size**2))
-             for v1 in xrange(size ** size)
-             for v0 in xrange(1))
-    
-    for f2_dict, f1_dict, f0, index in all_f:
+    
+    def __init__(self, f2, f1, f0=0, index=None, size=None):
+        '''
+        Constructor
+        '''
+        self.funcs = dict()
+        self.funcs['f2'] = f2
+        self.funcs['f1'] = f1
+        self.funcs['f0'] = f0
+        if size == None:
+            self.size = len(self.funcs['f1'].dict)
+        else:
+            self.size = size
+        if index == None:
+            if isinstance(self.size, int):
+                self.index = _index(self.funcs['f2'].dict,
+                                    self.funcs['f1'].dict,
+                                    self.funcs['f0'],
+                                    self.size)
+            else:
+                self.index = 'N/A'
+        else:
+            self.index = index
+        
+    def __eq__(self, other):
+        return ((type(self) == type(other)) and
+                (self.size == other.size) and
+                (self.funcs['f2'].dict == other.funcs['f2'].dict) and
+                (self.funcs['f1'].dict == other.funcs['f1'].dict) and
+                (self.funcs['f0'] == other.funcs['f0']))
+    
+    @classmethod
+    def dicts2bunny(cls, f2_dict, f1_dict, f0, index=None, size=None):
         f2 = _dict2f(f2_dict, 'f2')
         f1 = _dict2f(f1_dict, 'f1')
-        yield Bunny(f2, f1, f0, index)
+        return cls(f2, f1, f0, index, size)
+
+class CompactBunny(_BunnyBase):
+    '''
+    Finite bunny with f2 and f1 stored as bytearrays. The value f2(i, j) is
+    stored at position i + size*j and f1(i) at position i, in the same order
+    as digits of the index. Bunnies are equal if they have the same size and
+    index.
+    '''
+    __slots__ = ('f2_table', 'f1_table', 'f0', 'size', 'index', '_tables',
+                 '_funcs', '_key')
+    
+    def __init__(self, f2_table, f1_table, f0=0, index=None, size=None):
+        '''
+        Constructor
+        '''
+        self.f2_table = bytearray(f2_table)
+        self.f1_table = bytearray(f1_table)
+        self.f0 = f0
+        if size == None:
+            size = len(self.f1_table)
+        self.size = size
+        if index == None:
+            index = _table_index(self.f2_table, self.f1_table, f0, size)
+        self.index = index
+        self._tables = None
+        self._funcs = None
+        self._key = None
         
-def show(index, size):
+    def tables_key(self):
+        if self._key is None:
+            # the same key as for Bunny
+            self._key = (self.size, tuple(self.f2_table),
+                         tuple(self.f1_table), self.f0)
+        return self._key
+        
+    @property
+    def funcs(self):
+        if self._funcs is None:
+            self._funcs = {'f2': self.f2, 'f1': self.f1, 'f0': self.f0}
+        return self._funcs
+    
+    def f2(self, i, j):
+        if not (0 <= i < self.size and 0 <= j < self.size):
+            raise ArgError((i, j), 'f2')
+        return self.f2_table[i + self.size*j]
+    
+    def f1(self, i):
+        if not 0 <= i < self.size:
+            raise ArgError(i, 'f1')
+        return self.f1_table[i]
+    
+    def __eq__(self, other):
+        return ((type(self) == type(other)) and
+                (self.size == other.size) and
+                (self.index == other.index))
+    
+    def __ne__(self, other):
+        return not self.__eq__(other)
+    
+    def __hash__(self):
+        return hash((self.size, self.index))
+    
+    @classmethod
+    def dicts2bunny(cls, f2_dict, f1_dict, f0, index=None, size=None):
+        if size == None:
+            size = len(f1_dict)
+        f2_table = [f2_dict[i, j] for j in range(size) for i in range(size)]
+        f1_table = [f1_dict[i] for i in range(size)]
+        return cls(f2_table, f1_table, f0, index, size)
+        
+def bunnies(size, compact=False, up_to_iso=False):
+    '''
+    Create iterator over all finite bunnies on the domain of given size.
+    
+    @param compact: if True yield CompactBunny objects
+    @param up_to_iso: if True yield only one bunny from every class of
+    isomorphic bunnies, the one with the smallest index. The bunnies come in
+    the same order as without *up_to_iso*.
+    '''
+    if up_to_iso:
+        f1_tables = _canonical_f1_tables(size)
+    else:
+        f1_tables = [(v1, [v1 / size**i % size for i in range(size)], [])
+                     for v1 in xrange(size ** size)]
+    # functions are never changed, so bunnies with the same table share them
+    if not compact:
+        f1_funcs = [_dict2f(dict(enumerate(f1_table)), 'f1')
+                    for _, f1_table, _ in f1_tables]
+    for v2 in xrange(size ** (size**2)):
+        f2_table = [v2 / size**k % size for k in range(size**2)]
+        if not compact:
+            f2 = _dict2f(dict([[(i, j), f2_table[i + size*j]]
+                               for i in range(size)
+                               for j in range(size)]), 'f2')
+        for n, (v1, f1_table, stabilizer) in enumerate(f1_tables):
+            if stabilizer and not _is_canonical_f2(f2_table, stabilizer, size):
+                continue
+            index = v2 + v1*(size ** (size**2))
+            if compact:
+                yield CompactBunny(f2_table, f1_table, 0, index, size)
+            else:
+                yield Bunny(f2, f1_funcs[n], 0, index)
+
+class TableOdometer(object):
+    '''
+    Mixed-radix counter running over the tables of all finite bunnies of given
+    size in the order of bunnies(size). Tables are lists changed in place:
+    f1_table[i] = f1(i) and f2_table[i + size*j] = f2(i, j), f0 = 0. After
+    every step *changed* holds the cells that have changed as pairs
+    ('f1', i) or ('f2', i + size*j). f1 cells are the lowest digits.
+    
+    Usage:
+        odo = TableOdometer(3)
+        for index in odo:
+            ... read odo.f2_table, odo.f1_table, odo.changed ...
+    '''
+    
+    def __init__(self, size):
+        '''
+        Constructor
+        '''
+        self.size = size
+        self.f2_table = [0] * (size**2)
+        self.f1_table = [0] * size
+        self.index = 0
+        self.changed = []
+        # cells from the lowest digit with the change of index per unit
+        n2 = size ** (size**2)
+        self._digits = ([(self.f1_table, i, ('f1', i), size**i * n2)
+                         for i in range(size)] +
+                        [(self.f2_table, k, ('f2', k), size**k)
+                         for k in range(size**2)])
+        
+    def step(self):
+        '''
+        Go to the next bunny. Return False if there is no next bunny, the
+        tables are all zero then.
+        '''
+        size = self.size
+        changed = self.changed = []
+        for table, pos, cell, weight in self._digits:
+            changed.append(cell)
+            if table[pos] < size - 1:
+                table[pos] += 1
+                self.index += weight
+                return True
+            table[pos] = 0
+            self.index -= (size - 1) * weight
+        return False
+    
+    def __iter__(self):
+        self.f2_table[:] = [0] * len(self.f2_table)
+        self.f1_table[:] = [0] * len(self.f1_table)
+        self.index = 0
+        self.changed = [cell for _, _, cell, _ in self._digits]
+        yield self.index
+        while self.step():
+            yield self.index
+
+class IncrementalChecker(object):
+    '''
+    Checks identities from *id_ls* in the bunny given by the tables of
+    *odometer* (TableOdometer). For every identity and assignment of its
+    variables the cells of the tables read by the evaluation are recorded,
+    so after the odometer steps only the assignments depending on the changed
+    cells are evaluated again.
+    
+    Usage:
+        checker = IncrementalChecker(odo, id_ls)
+        for index in odo:
+            checker.update()
+            row = checker.row()
+    '''
+    
+    def __init__(self, odometer, id_ls):
+        '''
+        Constructor
+        '''
+        self.odometer = odometer
+        self.id_ls = id_ls
+        size = odometer.size
+        # number of failing assignments for every identity
+        self.fails = [0] * len(id_ls)
+        self.evaluations = 0
+        self._points = []
+        for id_no, id_ in enumerate(id_ls):
+            var_ls = list(id_.var_symbols)
+            for evaluation in itertools.product(xrange(size),
+                                                repeat=len(var_ls)):
+                self._points.append((id_no, dict(zip(var_ls, evaluation))))
+        self._failing = [False] * len(self._points)
+        self._reads = [set() for _ in self._points]
+        self._deps = dict()
+        self._read_cells = []
+        f2_table = odometer.f2_table
+        f1_table = odometer.f1_table
+        read_cells = self._read_cells
+        def f2(i, j):
+            k = i + size*j
+            read_cells.append(('f2', k))
+            return f2_table[k]
+        def f1(i):
+            read_cells.append(('f1', i))
+            return f1_table[i]
+        self._funcs = {'f2': f2, 'f1': f1, 'f0': 0}
+        for point_no in xrange(len(self._points)):
+            self._evaluate(point_no)
+        
+    def _evaluate(self, point_no):
+        id_no, dict_subs = self._points[point_no]
+        id_ = self.id_ls[id_no]
+        eval_dict = dict(dict_subs)
+        eval_dict.update(self._funcs)
+        del self._read_cells[:]
+        lhs = eval(id_.left_term.compiled_str, globals(), eval_dict)
+        rhs = eval(id_.right_term.compiled_str, globals(), eval_dict)
+        self.evaluations += 1
+        failing = lhs != rhs
+        if failing != self._failing[point_no]:
+            self._failing[point_no] = failing
+            self.fails[id_no] += 1 if failing else -1
+        reads = set(self._read_cells)
+        if reads == self._reads[point_no]:
+            return
+        for cell in self._reads[point_no]:
+            if not cell in reads:
+                self._deps[cell].discard(point_no)
+        for cell in reads:
+            self._deps.setdefault(cell, set()).add(point_no)
+        self._reads[point_no] = reads
+        
+    def update(self, changed=None):
+        '''
+        Evaluate again the assignments depending on *changed* cells, by
+        default on the cells changed by the last step of the odometer.
+        '''
+        if changed is None:
+            changed = self.odometer.changed
+        to_eval = set()
+        for cell in changed:
+            to_eval.update(self._deps.get(cell, ()))
+        for point_no in to_eval:
+            self._evaluate(point_no)
+    
+    def check(self, id_no):
+        '''
+        True if identity number *id_no* holds in the current bunny.
+        '''
+        return self.fails[id_no] == 0
+    
+    def row(self):
+        return [fails == 0 for fails in self.fails]
+
+class RowFiller(object):
+    '''
+    Fills rows of identities from *id_ls* using a base of valid implications.
+    When an identity holds in a bunny, the consequences of the identities
+    holding so far are marked as holding without evaluation. When it fails,
+    every identity implying it alone fails too. Identities are checked in
+    the order of estimated cost per identity they decide.
+    
+    Implications are given as objects with *premise* and *conclusion* or as
+    (premise, conclusion) pairs of identities or their strings. Implications
+    with premise not in *id_ls* are ignored, they must hold in every bunny
+    the filler is used for.
+    
+    Usage:
+        filler = RowFiller(id_ls, implications)
+        for bun in bunnies(size):
+            row = filler.fill(bun)
+    '''
+    
+    def __init__(self, id_ls, implications=()):
+        '''
+        Constructor
+        '''
+        self.id_ls = id_ls
+        self.evaluations = 0
+        positions = dict((str(id_), i) for i, id_ in enumerate(id_ls))
+        def bits(ids):
+            if isinstance(ids, basestring):
+                ids = [ids]
+            result = 0
+            for id_ in ids:
+                if not str(id_) in positions:
+                    return None
+                result |= 1 << positions[str(id_)]
+            return result
+        imps = []
+        for imp in implications:
+            if hasattr(imp, 'premise'):
+                premise, conclusion = imp.premise, imp.conclusion
+            else:
+                premise, conclusion = imp
+            premise_bits = bits(premise)
+            if premise_bits is None:
+                continue
+            conclusion_bits = 0
+            for id_ in conclusion:
+                if str(id_) in positions:
+                    conclusion_bits |= 1 << positions[str(id_)]
+            imps.append((premise_bits, conclusion_bits))
+        self._imps = imps
+        self._valid = self._close(0)
+        # identities following from i-th alone, and implying i-th alone
+        self._consequences = [self._close(1 << i) for i in xrange(len(id_ls))]
+        # during filling the single premise implications are applied through
+        # self._consequences, only the rest need chaining
+        self._imps = [(premise, self._close(conclusion))
+                      for premise, conclusion in imps
+                      if premise & (premise - 1)]
+        self._refuters = [0] * len(id_ls)
+        for i, consequences in enumerate(self._consequences):
+            for j in xrange(len(id_ls)):
+                if consequences >> j & 1:
+                    self._refuters[j] |= 1 << i
+        self._orders = dict()
+        
+    def order(self, size):
+        '''
+        Numbers of identities sorted by the estimated cost of checking in a
+        bunny of *size* per identity decided by the check.
+        '''
+        if not size in self._orders:
+            def cost(i):
+                id_ = self.id_ls[i]
+                evaluation = ((len(id_.func_symbols) + 2) *
+                              size ** len(id_.var_symbols))
+                decided = (bin(self._consequences[i]).count('1') +
+                           bin(self._refuters[i]).count('1'))
+                return float(evaluation) / decided
+            self._orders[size] = sorted(xrange(len(self.id_ls)), key=cost)
+        return self._orders[size]
+        
+    def _close(self, holds):
+        '''
+        Closure of bitset *holds* under the implications (forward chaining).
+        '''
+        changed = True
+        while changed:
+            changed = False
+            for premise, conclusion in self._imps:
+                if (premise & holds == premise and
+                    conclusion & holds != conclusion):
+                    holds |= conclusion
+                    changed = True
+        return holds
+    
+    def fill(self, bun, limit=None):
+        '''
+        Return row of bunny *bun*: list of bools, True iff the identity holds.
+        '''
+        holds = self._valid
+        fails = 0
+        size = bun.size if isinstance(bun.size, int) else limit
+        for i in self.order(size):
+            bit = 1 << i
+            if (holds | fails) & bit:
+                continue
+            self.evaluations += 1
+            if bun.check_id(self.id_ls[i], limit=limit):
+                holds |= self._consequences[i]
+                if self._imps:
+                    holds = self._close(holds)
+            else:
+                fails |= self._refuters[i]
+        return [bool(holds >> i & 1) for i in xrange(len(self.id_ls))]
+
+def _canonical_f1_tables(size):
+    '''
+    Find tables of f1 that may start a bunny with the smallest index among its
+    isomorphic copies. As f0 = 0 only permutations fixing 0 are considered.
+    f1 is more significant for the index than f2, therefore a table is
+    rejected if some permutation makes it smaller, and for the rest only the
+    permutations keeping f1 unchanged (stabilizer) matter for f2.
+    
+    @return: list of (v1, f1 table, stabilizer)
+    '''
+    perms = [(0,) + p for p in itertools.permutations(range(1, size))][1:]
+    ans = []
+    for v1 in xrange(size ** size):
+        f1_table = [v1 / size**i % size for i in range(size)]
+        key = f1_table[::-1]
+        stabilizer = []
+        for p in perms:
+            image = [None] * size
+            for i, x in enumerate(f1_table):
+                image[p[i]] = p[x]
+            image_key = image[::-1]
+            if image_key < key:
+                break
+            elif image_key == key:
+                stabilizer.append(p)
+        else:
+            ans.append((v1, f1_table, stabilizer))
+    return ans
+
+def _is_canonical_f2(f2_table, stabilizer, size):
+    '''
+    True if no permutation from *stabilizer* makes *f2_table* smaller.
+    '''
+    key = f2_table[::-1]
+    for p in stabilizer:
+        image = [None] * (size**2)
+        for k, x in enumerate(f2_table):
+            image[p[k % size] + size*p[k / size]] = p[x]
+        if image[::-1] < key:
+            return False
+    return True
+        
+def show(index, size, compact=False):
     '''
     Show bunny with given index.
+    
+    @param compact: if True return CompactBunny
     '''
     v2 = index % (size ** (size**2))
     v1 = ((index - v2) / (size ** (size**2))) % (size ** size)
     v0 = ((index - v2 - v1) / (size ** (size**2 + size))) % (size ** (size**2))
+    if compact:
+        f2_table = bytearray(v2 / size**k % size for k in range(size**2))
+        f1_table = bytearray(v1 / size**i % size for i in range(size))
+        return CompactBunny(f2_table, f1_table, v0, index, size)
     f2_dict = dict([[(i, j), (v2 / (size ** (i + size*j)) % size)]
                      for i in range(size)
                      for j in range(size)])
@@ -180,6 +649,16 @@ def show(index, size):
     f0 = v0
     return Bunny(f2, f1, f0, index)
 
+_cells_lists = dict()
+
+def _cells(size):
+    """
+    Inputs of f2 in the order of digits of index: (i, j) at i + size*j
+    """
+    if not size in _cells_lists:
+        _cells_lists[size] = [(i, j) for j in range(size) for i in range(size)]
+    return _cells_lists[size]
+
 def _index(f2_dict, f1_dict, f0_dict, size):
     """
     Find index given f2, f1, f0, and size
@@ -197,9 +676,103 @@ def _index(f2_dict, f1_dict, f0_dict, size):
     v0 = f0_dict
             
     return (v2 + v1*(size ** (size**2)) + v0*(size ** (size**2 + size)))
+
+def _table_index(f2_table, f1_table, f0, size):
+    """
+    Find index given tables of CompactBunny, f0, and size
+    """
+    v2 = sum(x * size**k for k, x in enumerate(f2_table))
+    v1 = sum(x * size**i for i, x in enumerate(f1_table))
+    return (v2 + v1*(size ** (size**2)) + f0*(size ** (size**2 + size)))
+        
+def canonical_index(bun, max_perms=40320):
+    """
+    Index of the canonical copy of finite bunny *bun*: isomorphic bunnies
+    give the same number. Elements are first split into classes by
+    invariants (f0, f1 cycle type, f2 row and column profiles) refined until
+    stable, the classes get the labels in the order of their invariants.
+    Only the permutations inside the classes are tried, the smallest index
+    is taken.
+    
+    @param max_perms: raise ValueError if more permutations would be needed
+    """
+    size = bun.size
+    f2 = bun.funcs['f2']
+    f1 = bun.funcs['f1']
+    f0 = bun.funcs['f0']
+    f2_table = [f2(k % size, k / size) for k in xrange(size**2)]
+    f1_table = [f1(i) for i in xrange(size)]
+    classes = _refined_classes(f2_table, f1_table, f0, size)
+    count = 1
+    for cls in classes:
+        for k in xrange(2, len(cls) + 1):
+            count *= k
+    if count > max_perms:
+        raise ValueError('{0} permutations needed for canonical index of '
+                         'bunny of size {1}'.format(count, size))
+    labels = []
+    start = 0
+    for cls in classes:
+        labels.append(range(start, start + len(cls)))
+        start += len(cls)
+    best = None
+    for perms in itertools.product(*[itertools.permutations(cls)
+                                     for cls in classes]):
+        p = [None] * size
+        for perm, cls_labels in zip(perms, labels):
+            for x, label in zip(perm, cls_labels):
+                p[x] = label
+        image2 = [None] * (size**2)
+        for k, x in enumerate(f2_table):
+            image2[p[k % size] + size*p[k / size]] = p[x]
+        image1 = [None] * size
+        for i, x in enumerate(f1_table):
+            image1[p[i]] = p[x]
+        # digits from the most significant
+        key = [p[f0]] + image1[::-1] + image2[::-1]
+        if best is None or key < best[0]:
+            best = (key, image2, image1, p[f0])
+    return _table_index(best[1], best[2], best[3], size)
+
+def _refined_classes(f2_table, f1_table, f0, size):
+    """
+    Split the domain into classes of elements with equal invariants, refined
+    by the classes of their images until stable. Return list of classes in
+    the order of invariants, the order does not depend on labelling.
+    """
+    # f1 cycle type: length of the cycle reached and steps to reach it
+    def cycle_type(x):
+        path = []
+        while not x in path:
+            path.append(x)
+            x = f1_table[x]
+        return len(path) - path.index(x), path.index(x)
+    preimages = [0] * size
+    for x in f1_table:
+        preimages[x] += 1
+    colors = [(x == f0, cycle_type(x), preimages[x],
+               f2_table.count(x),
+               sum(f2_table[x + size*y] == x for y in xrange(size)),
+               sum(f2_table[y + size*x] == x for y in xrange(size)))
+              for x in xrange(size)]
+    n_classes = 0
+    while True:
+        ranks = dict((c, r) for r, c in enumerate(sorted(set(colors))))
+        colors = [ranks[c] for c in colors]
+        if len(ranks) == n_classes:
+            break
+        n_classes = len(ranks)
+        # rows and columns of f2 as multisets of class triples
+        colors = [(colors[x], colors[f1_table[x]],
+                   colors[f2_table[x + size*x]],
+                   tuple(sorted((colors[y], colors[f2_table[x + size*y]],
+                                 colors[f2_table[y + size*x]])
+                                for y in xrange(size))))
+                  for x in xrange(size)]
+    return [[x for x in xrange(size) if colors[x] == r]
+            for r in xrange(n_classes)]
         
 def _dict2f(dict_f, f_name):
-    @memo
     def f(*args):
         if len(args) == 1: args = args[0]
         try:
@@ -308,13 +881,16 @@ class InfBunny(Bunny):
         return bun
     
     @classmethod
-    def find(cls, imp, wait_time, kern_size):
+    def find(cls, imp, wait_time, kern_size, stop=None):
         '''
         Find infinite bunny which is counter-example to implication *imp*
+        
+        @param stop: threading.Event, the search ends as on timeout when it
+        is set
         '''
         print 'Starting on implication: {}'.format(imp)
         try: 
-            bun = _inf_bunnies(imp, wait_time, kern_size)
+            bun = _inf_bunnies(imp, wait_time, kern_size, stop)
             print 'Infinite bunny found', bun, '\n'
             return (bun, 'Success')
         except StopIteration:
@@ -330,6 +906,150 @@ class InfBunny(Bunny):
             print reason
             return (None, reason)
         
+################################AFFINE OFFSETS
+# Values of piecewise functions are ints or str like 'n+1', 'm+n-2' - affine
+# forms over n and m with integer coefficients. Equations of such forms are
+# solved here directly, sympy is left for the forms of other kind.
+_affine_syms = ('m', 'm1', 'n', 'n1') # in the order sympy prints them
+_affine_term_re = re.compile(r'([+-]?)(?:(\d+)\*)?([mn]1?)|([+-]?)(\d+)')
+_affine_cache = {}
+_not_affine = object()
+
+def _affine(expr):
+    '''
+    Parse integer affine form.
+
+    @param expr: int or str like 'n+1', '-2*m+n1-3'
+    @return: dict symbol: coefficient with key 1 for the constant term, None
+    if *expr* is not an affine form
+    '''
+    if isinstance(expr, (int, long)):
+        return {1: expr}
+    try:
+        return _affine_cache[expr]
+    except KeyError:
+        pass
+    form = {1: 0}
+    s = expr.replace(' ', '')
+    pos = 0
+    while pos < len(s):
+        match = _affine_term_re.match(s, pos)
+        if (match is None or
+            (pos and not (match.group(1) or match.group(4)))):
+            form = None
+            break
+        sign, coeff, sym, csign, const = match.groups()
+        if sym is None:
+            sign, coeff, sym = csign, const, 1
+        coeff = int(coeff or 1)
+        form[sym] = form.get(sym, 0) + (-coeff if sign == '-' else coeff)
+        pos = match.end()
+    if form is not None:
+        form = dict((k, v) for k, v in form.items() if v or k == 1)
+    _affine_cache[expr] = form
+    return form
+
+def _affine_str(form):
+    '''
+    Return str of affine *form* as sympy prints it, without spaces.
+    '''
+    const = form.get(1, 0)
+    terms = [(sym, form[sym]) for sym in _affine_syms if form.get(sym)]
+    if not terms:
+        return str(const)
+    def term_str(sym, coeff):
+        if coeff in (1, -1):
+            return sym if coeff == 1 else '-' + sym
+        return '{}*{}'.format(coeff, sym)
+    if len(terms) == 1 and terms[0][1] < 0 and const > 0:
+        return str(const) + term_str(*terms[0])
+    out = term_str(*terms[0])
+    for sym, coeff in terms[1:]:
+        out += ('+' if coeff > 0 else '') + term_str(sym, coeff)
+    if const:
+        out += ('+' if const > 0 else '') + str(const)
+    return out
+
+def _solve_affine(eq_system):
+    '''
+    Solve *eq_system* for n and m the way sympy.solve(eq_system, ['n', 'm'])
+    does: Gauss elimination with n taken as pivot first, the unknowns without
+    pivot stay free.
+
+    @param eq_system: list of (lhs, rhs), lhs affine form over n and m, rhs
+    affine form over n1 and m1
+    @return: dict 'n' or 'm': affine form, None if the system has no solution,
+    _not_affine if the system or its solution is not of integer affine forms
+    '''
+    rows = []
+    for lhs, rhs in eq_system:
+        lhs, rhs = _affine(lhs), _affine(rhs)
+        if (lhs is None or rhs is None or
+            any(k not in (1, 'n', 'm') for k in lhs) or
+            any(k in ('n', 'm') for k in rhs)):
+            return _not_affine
+        right = dict(rhs)
+        right[1] -= lhs[1]
+        rows.append([lhs.get('n', 0), lhs.get('m', 0), right])
+    pivots = []
+    for col in (0, 1):
+        r = len(pivots)
+        for i in range(r, len(rows)):
+            if rows[i][col]:
+                break
+        else:
+            continue
+        rows[r], rows[i] = rows[i], rows[r]
+        piv = rows[r][col]
+        if piv in (1, -1):
+            # stays integer, the usual case
+            scale = lambda v: v*piv
+        else:
+            scale = lambda v: Fraction(v)/piv
+        rows[r] = [scale(rows[r][0]), scale(rows[r][1]),
+                   dict((k, scale(v)) for k, v in rows[r][2].items())]
+        for i in range(len(rows)):
+            factor = rows[i][col]
+            if i == r or not factor:
+                continue
+            right = dict(rows[i][2])
+            for k, v in rows[r][2].items():
+                right[k] = right.get(k, 0) - factor*v
+            rows[i] = [rows[i][0] - factor*rows[r][0],
+                       rows[i][1] - factor*rows[r][1], right]
+        pivots.append(col)
+    if any(any(rows[i][2].values()) for i in range(len(pivots), len(rows))):
+        return None
+    if rows and not pivots:
+        return _not_affine
+    solution = {}
+    for r, col in enumerate(pivots):
+        form = dict(rows[r][2])
+        if col == 0 and rows[r][1]:
+            form['m'] = -rows[r][1]
+        if any(v.denominator != 1 for v in form.values()):
+            return _not_affine
+        solution['nm'[col]] = dict((k, int(v)) for k, v in form.items() if v)
+    return solution
+
+def _affine_value(expr, solution):
+    '''
+    Substitute *solution* of _solve_affine into affine form str *expr*.
+
+    @return: str of the result as sympy prints it, None if *expr* is not an
+    affine form
+    '''
+    form = _affine(expr)
+    if form is None:
+        return None
+    out = {1: form.get(1, 0)}
+    for sym, coeff in form.items():
+        if sym == 1:
+            continue
+        for k, v in solution.get(sym, {sym: 1}).items():
+            out[k] = out.get(k, 0) + coeff*v
+    return _affine_str(out)
+
 class PiecewiseFunc(object):
     '''
     Class for piecewise-defined functions
@@ -344,6 +1064,35 @@ class PiecewiseFunc(object):
         self.name = f_name
         self.else_val = else_val
         self.size = size
+        self._indexed = None
+        
+    def _index(self):
+        '''
+        Return indexes of the graph: dict from input (tuple of str) to output
+        of the first row with this input, and list of buckets of rows with 'n'
+        or 'm' and without unset values - rows with one varying symbol, rows
+        with two. Built again when the graph is replaced or any variable
+        changes, see Variable._version.
+        '''
+        if (self._indexed is not self.graph or
+            self._indexed_state != (len(self.graph), Variable._version)):
+            self._exact = dict()
+            self._vary = [[] for _ in vary_syms]
+            self._indexed = self.graph
+            for t in self.graph:
+                self._index_row(t)
+            self._indexed_state = (len(self.graph), Variable._version)
+        return self._exact, self._vary
+
+    def _index_row(self, t):
+        strs = map(str, t)
+        self._exact.setdefault(tuple(strs[:-1]), t[-1])
+        t_str = ''.join(strs)
+        syms = [c for c in vary_syms if c in t_str]
+        # rows with unset values are left out, this is experimental in order
+        # to avoid identifying n and m while imposing bindings
+        if syms and not any(v.isunset() for v in t):
+            self._vary[len(syms)-1].append(t)
         
     def __call__(self, *args):
         var_args = []
@@ -352,27 +1101,20 @@ class PiecewiseFunc(object):
                 arg = Value(arg)
             var_args.append(arg)
         args = tuple(var_args)
+        exact, vary = self._index()
         # if in kern or no size
-        for t in self.graph:
-            if args == t[:-1]:
-                return t[-1]
+        try:
+            return exact[tuple(map(str, args))]
+        except KeyError:
+            pass
         # if not in kern or no size
-        for t in sorted(self.graph, key=lambda x: len({v for v in ['n', 'm']
-                                                       if v in ''.join(map(str, x)) })):
+        for t in itertools.chain(*vary):
             min_n_add = min([int(str(x)[-2:]) for x in t[:-1] if str(x)[0] in ['m', 'n']] + [0])
             if self.size and all(arg.isint() for arg in args) and all(arg.value < (self.size+min_n_add) for arg in args):
 #                 print 'here'
 #                 print t, args
 #                 print self.size, min_n_add
                 continue
-            t_str = reduce(lambda x,y: x+y, map(str, t), '')
-            if not any(c in t_str for c in vary_syms):
-                continue
-            if any(t[i] != args[i] for i in range(len(args)) if t[i].value == None):
-                continue
-            if any(v.isunset() for v in t): # this is experimental in order to avoid identifying n and m while imposing bindings
-                continue
-            
             eq_system = []
             gotonextt = False
             for i in range(len(args)):
@@ -391,28 +1133,56 @@ class PiecewiseFunc(object):
                     continue
                 if isinstance(rhs, str):
                     rhs = rhs.replace('n', 'n1').replace('m', 'm1')
-                equ = sympy.Eq( sympy.sympify(lhs), sympy.sympify(rhs) )
-                eq_system.append(equ)
+                eq_system.append((lhs, rhs))
             if gotonextt: continue
-            solution = sympy.solve(eq_system, ['n', 'm'])
-            if not eq_system or (solution and
-                                 not any(x in map(str, solution.keys())
-                                         for x in ['n1', 'm1'])):
+            solution = _solve_affine(eq_system)
+            if solution is None:
+                continue
+            ans = None
+            if solution is not _not_affine:
                 if isinstance(t[-1], Variable) and t[-1].value == None:
                     return t[-1]
-                else:
-                    ans = sympy.sympify(str(t[-1])).subs(solution)
-                    ans = str(ans).replace('n1', 'n').replace('m1', 'm')
-                    try: ans = int(ans)
-                    except: pass
-                    return Value(ans)
+                ans = _affine_value(str(t[-1]), solution)
+            if ans is None:
+                ans = self._sympy_call(eq_system, t[-1])
+                if ans is None:
+                    continue
+                return ans
+            ans = ans.replace('n1', 'n').replace('m1', 'm')
+            try: ans = int(ans)
+            except: pass
+            return Value(ans)
         if self.else_val != None:
             return self.else_val
         raise ArgError(args, self.name)
     
+    def _sympy_call(self, eq_system, out):
+        '''
+        Solve *eq_system* of (lhs, rhs) with sympy, return value of *out* for
+        the solution or None if there is no solution.
+        '''
+        eq_system = [sympy.Eq(sympy.sympify(lhs), sympy.sympify(rhs))
+                     for lhs, rhs in eq_system]
+        solution = sympy.solve(eq_system, ['n', 'm'])
+        if not eq_system or (solution and
+                             not any(x in map(str, solution.keys())
+                                     for x in ['n1', 'm1'])):
+            if isinstance(out, Variable) and out.value == None:
+                return out
+            else:
+                ans = sympy.sympify(str(out)).subs(solution)
+                ans = str(ans).replace('n1', 'n').replace('m1', 'm')
+                try: ans = int(ans)
+                except: pass
+                return Value(ans)
+        return None
+
     def add_value(self, input, output):
-        assert not any(x[:-1] == input for x in self.graph)
+        exact, _ = self._index()
+        assert not tuple(map(str, input)) in exact
         self.graph.append(input + (output,))
+        self._index_row(self.graph[-1])
+        self._indexed_state = (len(self.graph), Variable._version)
         
     def __deepcopy__(self, memo):
         newone = type(self)(None, None)
@@ -455,6 +1225,7 @@ class Variable(object):
     _ids = itertools.count(0)
     _values_dict = dict()
     _registry = []
+    _version = 0 # changed whenever value or id of any variable changes
     
     def __init__(self, id_ = None):
         if id_ == None:
@@ -484,6 +1255,7 @@ class Variable(object):
         if isinstance(new_value, str) and not new_value[-1].isdigit():
             new_value += '+0'
         self._values_dict[self.id] = new_value
+        Variable._version += 1
         
     def identify(self, other):
         if isinstance(other, Value):
@@ -492,6 +1264,7 @@ class Variable(object):
             for var in filter(lambda v: v.id == self.id, Variable._registry):
                 var.id = other.id
             self.id = other.id
+            Variable._version += 1
         elif isinstance(other, int) or isinstance(other, str):
             self.value = other
         else:
@@ -558,6 +1331,7 @@ class Variable(object):
         cls._registry = []
         cls._ids = itertools.count(0)
         cls._values_dict = dict()
+        Variable._version += 1
         
 def identify_variables(var1, var2):
     if isinstance(var2, Variable) and var2.value == None:
@@ -592,14 +1366,14 @@ class Value(Variable):
         return self._value
     
 #############################GENERATION OF INFINITE BUNNIES 2###############
-def _inf_bunnies(imp, wait_time, kern_size):
+def _inf_bunnies(imp, wait_time, kern_size, stop=None):
     '''
     Create infinite bunnies that satisfy all id_pos_ls and do not satisfy id_neg.
     
     Alternative version, uses bindings obtained from id_pos_ls and kind of
     backtracking.
     '''
-    bun = construct(imp, wait_time, kern_size)
+    bun = construct(imp, wait_time, kern_size, stop)
     try:
         assert not imp.conclusion or any(not bun.check_id(id_, kern_size+4) for id_ in imp.conclusion)
         assert all(bun.check_id(id_, kern_size+4) for id_ in imp.premise)
@@ -758,13 +1532,18 @@ def impose_bindings(bun, id_, domain_dict, var_deps):
                 var_deps[new_v.id] = e.vals
                 bun.funcs[e.f_name].add_value(e.vals, new_v)
             
-def construct(imp, wait_time, kern_size=3):
+def construct(imp, wait_time, kern_size=3, stop=None):
     """
     Construct and return bunny that satisfies all identities from id_ls.
     
     @param kern_size: size of kernel of algebra, which is essentially the
     counter-example. 
+    @param stop: threading.Event, TimeoutError is raised when it is set
     """
+    def timeout():
+        return (time.time()-ts >= wait_time or
+                (stop is not None and stop.is_set()))
+
     def fetch_next(bun, undef_vars, def_vars, get_domain, ids_neg):
         vars_number = len(undef_vars) + len(def_vars)
         if vars_number == 0:
@@ -775,7 +1554,7 @@ def construct(imp, wait_time, kern_size=3):
                 raise StopIteration
         while True:
             # Check time constraint
-            if time.time()-ts >= wait_time:
+            if timeout():
                 raise TimeoutError
             try:
                 var = undef_vars.pop()
@@ -846,7 +1625,7 @@ def construct(imp, wait_time, kern_size=3):
     ts = time.time()
     while True:
         # Check time constraint
-        if time.time()-ts >= wait_time:
+        if timeout():
             raise TimeoutError
         fetch_next(bun, undef_vars, def_vars, get_domain, imp.conclusion)
         if violates_ids(bun, imp.conclusion):
@@ -0,0 +1,210 @@
+"""
+Holds BitContext: formal context of bunnies and identities stored as bitsets.
+
+Every row (object) is a Python int with bit j set iff the object has j-th
+attribute, every column (attribute) is an int with bit i set iff i-th object
+has the attribute. Extents, intents and closures are then computed by AND over
+the columns and they are ints as well.
+"""
+import binascii
+
+import numpy as np
+
+class BitContext(object):
+    '''
+    Formal context with rows and columns as int bitsets.
+
+    Usage:
+        cxt = BitContext.from_fca(fca_cxt)
+        closed = cxt.closure(cxt.attrs2bits(premise))
+    '''
+
+    def __init__(self, rows, objects, attributes, columns=None):
+        '''
+        Constructor
+
+        @param rows: list of ints, bit j of i-th row is set iff i-th object
+        has j-th attribute
+        @param columns: transposed *rows*, computed if not given
+        '''
+        self.rows = list(rows)
+        self.objects = list(objects)
+        self.attributes = list(attributes)
+        if columns is None:
+            matrix = _ints2matrix(self.rows, len(self.attributes))
+            columns = _matrix2ints(matrix.T)
+        self.columns = columns
+        self._attr_numbers = dict((str(attr), j)
+                                  for j, attr in enumerate(self.attributes))
+
+    def __len__(self):
+        return len(self.rows)
+
+    @classmethod
+    def from_table(cls, table, objects, attributes):
+        '''
+        Make context from cross table given as list of lists of bools.
+        '''
+        matrix = np.array(table, dtype=bool).reshape(len(objects),
+                                                     len(attributes))
+        return cls(_matrix2ints(matrix), objects, attributes,
+                   _matrix2ints(matrix.T))
+
+    @classmethod
+    def from_packed(cls, packed, objects, attributes):
+        '''
+        Make context from rows packed by np.packbits(axis=1), e.g. by
+        vectorized.satisfaction_matrix(..., packed=True).
+        '''
+        matrix = np.unpackbits(np.asarray(packed, dtype=np.uint8), axis=1)
+        matrix = matrix[:, :len(attributes)].astype(bool)
+        return cls(_matrix2ints(matrix), objects, attributes,
+                   _matrix2ints(matrix.T))
+
+    @classmethod
+    def from_fca(cls, cxt):
+        '''
+        Make context from fca.Context.
+        '''
+        return cls.from_table(cxt.table, cxt.objects, cxt.attributes)
+
+    def to_fca(self):
+        '''
+        Return the same context as fca.Context.
+        '''
+        import fca
+        return fca.Context(self.table(), self.objects, self.attributes)
+
+    def table(self):
+        '''
+        Return cross table as list of lists of bools.
+        '''
+        return _ints2matrix(self.rows, len(self.attributes)).tolist()
+
+    def packed(self):
+        '''
+        Return rows packed as by np.packbits(axis=1).
+        '''
+        return np.packbits(_ints2matrix(self.rows, len(self.attributes)),
+                           axis=1)
+
+    @property
+    def all_objects(self):
+        return (1 << len(self.rows)) - 1
+
+    @property
+    def all_attributes(self):
+        return (1 << len(self.attributes)) - 1
+
+    def attrs2bits(self, attrs):
+        '''
+        Return bitset of attributes *attrs* given by names (or identities).
+        '''
+        bits = 0
+        for attr in attrs:
+            bits |= 1 << self._attr_numbers[str(attr)]
+        return bits
+
+    def bits2attrs(self, bits):
+        '''
+        Return list of attributes of bitset *bits*.
+        '''
+        return [self.attributes[j] for j in _bit_numbers(bits)]
+
+    def extent(self, attr_bits):
+        '''
+        Return bitset of objects having all the attributes of *attr_bits*.
+        '''
+        ext = self.all_objects
+        for j in _bit_numbers(attr_bits):
+            ext &= self.columns[j]
+        return ext
+
+    def intent(self, obj_bits):
+        '''
+        Return bitset of attributes shared by all the objects of *obj_bits*.
+        '''
+        intent = 0
+        for j, column in enumerate(self.columns):
+            if column & obj_bits == obj_bits:
+                intent |= 1 << j
+        return intent
+
+    def closure(self, attr_bits):
+        '''
+        Return closure of attribute bitset *attr_bits*: attributes of all the
+        objects having *attr_bits*.
+        '''
+        return self.intent(self.extent(attr_bits))
+
+    def holds(self, premise_bits, conclusion_bits):
+        '''
+        True iff implication premise -> conclusion holds in the context.
+        '''
+        ext = self.extent(premise_bits)
+        for j in _bit_numbers(conclusion_bits & ~premise_bits):
+            if self.columns[j] & ext != ext:
+                return False
+        return True
+
+    def add_object(self, row, obj):
+        '''
+        Add object *obj* with row bitset *row*.
+        '''
+        bit = 1 << len(self.rows)
+        self.rows.append(row)
+        self.objects.append(obj)
+        for j in _bit_numbers(row):
+            self.columns[j] |= bit
+
+    def reduce_objects(self):
+        '''
+        Return context keeping only the first object of every distinct row.
+        '''
+        seen = set()
+        rows = []
+        objects = []
+        for row, obj in zip(self.rows, self.objects):
+            if not row in seen:
+                seen.add(row)
+                rows.append(row)
+                objects.append(obj)
+        return BitContext(rows, objects, self.attributes)
+
+def _bit_numbers(bits):
+    '''
+    Numbers of set bits of *bits* in increasing order.
+    '''
+    numbers = []
+    while bits:
+        low = bits & -bits
+        numbers.append(low.bit_length() - 1)
+        bits ^= low
+    return numbers
+
+def _matrix2ints(matrix):
+    '''
+    Convert 2d boolean array into list of ints, bit j of i-th int is
+    matrix[i, j].
+    '''
+    n_rows, width = matrix.shape
+    if width == 0:
+        return [0] * n_rows
+    pad = -width % 8
+    # reversed and padded on the left, so that big-endian bytes give bit j
+    bits = np.zeros((n_rows, width + pad), dtype=bool)
+    bits[:, pad:] = matrix[:, ::-1]
+    packed = np.packbits(bits, axis=1)
+    return [int(binascii.hexlify(row.tostring()), 16) for row in packed]
+
+def _ints2matrix(ints, width):
+    '''
+    Inverse of _matrix2ints.
+    '''
+    n_bytes = (width + 7) // 8
+    if width == 0:
+        return np.zeros((len(ints), 0), dtype=bool)
+    hex_rows = ''.join('{0:0{1}x}'.format(row, 2 * n_bytes) for row in ints)
+    packed = np.frombuffer(binascii.unhexlify(hex_rows), dtype=np.uint8)
+    bits = np.unpackbits(packed.reshape(len(ints), n_bytes), axis=1)
+    return bits[:, ::-1][:, :width].astype(bool)
@@ -6,10 +6,12 @@ Created on Apr 27, 2013
 @author: Artem
 '''
 import copy
-import itertools
-from string import maketrans
+import hashlib
+import imp
+import marshal
 import re
-import compiler
+
+import numpy
 
 # import fca
 
@@ -21,22 +23,82 @@ class NotInUniverseError(Exception):
     def __str__(self):
         return self.message
     
-#######################DECORATORS############################################
-def memo(f):
-    """Decorator that caches the return value for each call to f(args).
-    Then when called again with same args, we can just look it up."""
-    cache = {}
-    def _f(*args):
-        try:
-            return cache[args]
-        except KeyError:
-            cache[args] = result = f(*args)
-            return result
-        except TypeError:
-            # some element of args can't be a dict key
-            return f(*args)
-    _f.__name__ = f.__name__
-    return _f
+class ParseError(Exception):
+    def __init__(self, message):
+        self.message = message
+    def __str__(self):
+        return self.message
+    
+#######################CACHE##################################################
+class LRUCache(object):
+    '''
+    Cache of bounded size: when full, the least recently used entry is evicted.
+    Counts hits, misses and evictions. Entries are kept in a circular doubly
+    linked list of [prev, next, key, value] in the order of use.
+    '''
+    
+    def __init__(self, maxsize=2**16):
+        self.maxsize = maxsize
+        self.clear()
+        
+    def get(self, key, default=None):
+        link = self._links.get(key)
+        if link is None:
+            self.misses += 1
+            return default
+        prev, next_, _, value = link
+        prev[1] = next_
+        next_[0] = prev
+        root = self._root
+        last = root[0]
+        last[1] = root[0] = link
+        link[0] = last
+        link[1] = root
+        self.hits += 1
+        return value
+    
+    def __setitem__(self, key, value):
+        link = self._links.get(key)
+        if link is not None:
+            link[3] = value
+            self.get(key)
+            self.hits -= 1
+            return
+        root = self._root
+        last = root[0]
+        link = [last, root, key, value]
+        last[1] = root[0] = self._links[key] = link
+        self._shrink()
+        
+    def __len__(self):
+        return len(self._links)
+    
+    def _shrink(self):
+        root = self._root
+        while len(self._links) > self.maxsize:
+            oldest = root[1]
+            root[1] = oldest[1]
+            oldest[1][0] = root
+            del self._links[oldest[2]]
+            self.evictions += 1
+    
+    def resize(self, maxsize):
+        self.maxsize = maxsize
+        self._shrink()
+    
+    def clear(self):
+        self._links = dict()
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+        self.hits = self.misses = self.evictions = 0
+        
+    def stats(self):
+        return {'size': len(self._links), 'maxsize': self.maxsize,
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+# Values of terms in finite bunnies, see Term.__call__
+term_cache = LRUCache()
 
 ##############################################################################
 class Identity(object):
@@ -56,8 +118,12 @@ class Identity(object):
         self.func_symbols = left_term.func_symbols + right_term.func_symbols
         
     def __str__(self):
-        return (str(self.left_term.name).strip() + ' = ' +
-                str(self.right_term.name).strip())
+        try:
+            return self._str
+        except AttributeError:
+            self._str = (str(self.left_term.name).strip() + ' = ' +
+                         str(self.right_term.name).strip())
+            return self._str
     
     @classmethod
     def str2id(cls, id_str):
@@ -79,11 +145,42 @@ class Identity(object):
         right_term = Term(right_str, right_str)
         return cls(left_term, right_term)
     
+    @property
+    def canonical_key(self):
+        '''
+        String equal for identities that differ only by renaming of variables
+        and swapping of the sides: variables are renamed to x, y, z, w in the
+        order of first occurrence and the smaller of both orientations is
+        taken.
+        '''
+        try:
+            return self._canonical_key
+        except AttributeError:
+            left, right = self.left_term.func_str, self.right_term.func_str
+            self._canonical_key = min(_rename_vars(left + ' = ' + right),
+                                      _rename_vars(right + ' = ' + left))
+            return self._canonical_key
+    
+    @property
+    def number(self):
+        '''
+        Dense integer id of the identity in *registry*.
+        '''
+        try:
+            return self._number
+        except AttributeError:
+            self._number = registry.intern(self)
+            return self._number
+    
     def __eq__(self, other):
         return self.__str__() == other.__str__()
         
     def __hash__(self):
-        return self.__str__().__hash__()
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = self.__str__().__hash__()
+            return self._hash
     
     
 class Term(object):
@@ -97,31 +194,92 @@ class Term(object):
         Constructor
         '''
         self.func_str = func_str #term rewritten as applications of functions
-        self.compiled_str = compile(func_str, '', 'eval')
         self.name = name
-        self.var_symbols = set(_get_var_symbols(func_str))
-        self.func_symbols = _get_func_symbols(func_str)
+        symbols = _symbols_re.findall(func_str)
+        self.func_symbols = [x for x in symbols if x[0] == 'f']
+        self.var_symbols = set(symbols).difference(self.func_symbols)
+        self._var_order = sorted(self.var_symbols)
+        
+    def _record(self):
+        '''
+        Marshallable tuple of the term, see _restore.
+        '''
+        return (self.func_str, self.name, tuple(self._var_order),
+                tuple(self.func_symbols), self.compiled_str)
+    
+    @classmethod
+    def _restore(cls, func_str, name, var_order, func_symbols, code):
+        '''
+        Make term from tuple returned by _record without parsing.
+        '''
+        term = cls.__new__(cls)
+        term.func_str = func_str
+        term.name = name
+        term.var_symbols = set(var_order)
+        term.func_symbols = list(func_symbols)
+        term._var_order = list(var_order)
+        term._compiled_str = code
+        return term
+    
+    @property
+    def compiled_str(self):
+        '''
+        func_str compiled for eval, compiled on first use
+        '''
+        try:
+            return self._compiled_str
+        except AttributeError:
+            self._compiled_str = compile(self.func_str, '', 'eval')
+            return self._compiled_str
+    
+    @property
+    def tree(self):
+        '''
+        func_str parsed into tree, see parse_term
+        '''
+        try:
+            return self._tree
+        except AttributeError:
+            self._tree = parse_term(self.func_str)
+            return self._tree
         
-    @memo
     def __call__(self, algebra, dict_values):
         '''
         evaluate the term for given algebra and values of variables. Variables
         are *x*, *y*, *z*, and *w*. Functions are picked up from algebra where
         they must have the same names (e.g. for functional symbol 'f2_join'
         there must be a function *algebra.f2_join*). 
+        
+        Values in finite bunnies are cached in *term_cache* by the tables of
+        the bunny (see tables_key of bunny.Bunny) and the values of the
+        variables of the term.
                 
         @return: value from algebra's universe (natural numbers) or None if
         not defined
         '''
+        key = None
+        if (self.func_symbols and
+            isinstance(getattr(algebra, 'size', None), int) and
+            hasattr(algebra, 'tables_key')):
+            tables = algebra.tables_key()
+            if tables is not None:
+                key = (self.func_str, tables,
+                       tuple(dict_values[v] for v in self._var_order))
+        if key is not None:
+            result = term_cache.get(key)
+            if result is not None:
+                return result
         eval_dict = dict_values.copy() 
         eval_dict.update( dict((x, algebra.funcs["{}".format(x)])
                                for x in self.func_symbols) )
         result = eval(self.compiled_str, globals(), eval_dict)
         if isinstance(result, int) and (result < 0):
             info = 'result = {0}, '.format(result)
-            info += 'values = {0}, '.format(values)
+            info += 'values = {0}, '.format(dict_values)
             info += 'func_str = {0}'.format(self.func_str)
             raise NotInUniverseError(info)
+        if key is not None:
+            term_cache[key] = result
         return result
          
     def __str__(self):
@@ -133,33 +291,12 @@ class Term(object):
     @classmethod
     def str2term(cls, str_):
         '''
-        make term from str
-        '''
-        instance = compiler.parse(str_)
-        parsed = str(instance.node.nodes[0].expr)
-        replace_lst = [('Mul(', 'f2'), ('UnarySub', 'f1'), ("Name('", ''),
-                       ('a', 'f0'), ("')", ''), (' ', '')]
-        func_str = parsed
-        for old, new in replace_lst:
-            func_str = func_str.replace(old, new)
-        # parse function returns all multiplications with double parentheses
-        par_balance = 0
-        f2_comma_balance = func_str.count('f2')
-        to_rm = []
-        for pos in xrange(len(func_str)):
-            c = func_str[pos]
-            if c == '(':
-                par_balance += 1
-            elif c == ')':
-                par_balance -= 1
-                if par_balance < f2_comma_balance:
-                    par_balance += 1
-                    to_rm.append(pos)
-            elif c == ',':
-                f2_comma_balance -= 1
-        func_str = ''.join([func_str[i] for i in xrange(len(func_str))
-                            if not i in to_rm])
-        return cls(func_str, str_)
+        make term from str, e.g. 'a*(-x)', see parse_term
+        '''
+        tree = parse_term(str_)
+        term = cls(_tree2func_str(tree), str_)
+        term._tree = tree
+        return term
     
     @classmethod
     def parsed2term(cls, parsed):
@@ -206,74 +343,315 @@ class Term(object):
         func_str = apply_op(var_list, op_order, op_types)
         return cls(func_str, name)
 
-def _get_func_symbols(func_str):
+class TermDAG(object):
+    '''
+    Interned terms of identities: every distinct subterm is stored once as a
+    node with integer id. Nodes are ('f2', id1, id2), ('f1', id1), ('f0',) or
+    ('var', name), the arguments always have smaller ids. For a finite bunny
+    the value table of every node over the grid of assignments is computed
+    once and shared by all the identities.
+    '''
+    
+    def __init__(self, id_ls=()):
+        '''
+        Constructor
+        '''
+        self.nodes = []
+        self.var_symbols = []
+        self.identities = []
+        self._node_ids = dict()
+        for id_ in id_ls:
+            self.add_identity(id_)
+        
+    def intern(self, node):
+        '''
+        Return id of *node*, add it if new.
+        '''
+        try:
+            return self._node_ids[node]
+        except KeyError:
+            self._node_ids[node] = node_id = len(self.nodes)
+            self.nodes.append(node)
+            if node[0] == 'var':
+                self.var_symbols.append(node[1])
+            return node_id
+        
+    def add_term(self, term):
+        '''
+        Return id of the node of *term*.
+        '''
+        return self._add_tree(term.tree)
+    
+    def _add_tree(self, tree):
+        if isinstance(tree, str):
+            if tree == 'f0':
+                return self.intern(('f0',))
+            return self.intern(('var', tree))
+        return self.intern((tree[0],) + tuple(map(self._add_tree, tree[1:])))
+    
+    def add_identity(self, id_):
+        '''
+        Add identity, return ids of the nodes of its left and right terms.
+        '''
+        pair = (self.add_term(id_.left_term), self.add_term(id_.right_term))
+        self.identities.append(pair)
+        return pair
+    
+    def evaluate(self, f2, f1, f0):
+        '''
+        Compute value tables of all nodes. Arguments are Cayley tables of
+        one bunny or stacked tables of a batch of bunnies as returned by
+        vectorized.cayley_tables and vectorized.stack_tables. Every variable
+        varies along its own axis (in the order of *var_symbols*), for a batch
+        the first axis corresponds to bunnies.
+        
+        @return: list of numpy arrays, one for every node
+        '''
+        batch = f2.ndim == 3
+        size = f2.shape[-1]
+        n_axes = len(self.var_symbols) + batch
+        if batch:
+            bun_ind = numpy.arange(len(f0)).reshape((-1,) + (1,)*(n_axes-1))
+            f0 = numpy.asarray(f0).reshape(bun_ind.shape)
+        values = []
+        for node in self.nodes:
+            if node[0] == 'var':
+                shape = [1] * n_axes
+                shape[batch + self.var_symbols.index(node[1])] = size
+                value = numpy.arange(size).reshape(shape)
+            elif node[0] == 'f0':
+                value = numpy.asarray(f0)
+            elif node[0] == 'f1':
+                if batch:
+                    value = f1[bun_ind, values[node[1]]]
+                else:
+                    value = f1[values[node[1]]]
+            else:
+                if batch:
+                    value = f2[bun_ind, values[node[1]], values[node[2]]]
+                else:
+                    value = f2[values[node[1]], values[node[2]]]
+            values.append(value)
+        return values
+    
+    def check(self, f2, f1, f0):
+        '''
+        Check all the identities, arguments as in *evaluate*.
+        
+        @return: list of bools for one bunny or boolean array of shape
+        (bunnies, identities) for a batch
+        '''
+        values = self.evaluate(f2, f1, f0)
+        if f2.ndim == 3:
+            ans = numpy.empty((len(f0), len(self.identities)), dtype=bool)
+            for col, (left, right) in enumerate(self.identities):
+                eq = values[left] == values[right]
+                ans[:, col] = eq.reshape(eq.shape[0], -1).all(axis=1)
+            return ans
+        return [bool((values[left] == values[right]).all())
+                for left, right in self.identities]
+
+###################################IDENTITY REGISTRY
+class IdentityRegistry(object):
+    '''
+    Table giving every identity a dense integer id in the order of
+    registration. Identities are keyed on str, as in Identity.__eq__. Sets of
+    identities are represented as int bitsets: identity with id n is in the set
+    iff bit n is set, so that union, intersection and inclusion are int
+    operations.
+    '''
+    
+    def __init__(self):
+        '''
+        Constructor
+        '''
+        self.identities = []
+        self._numbers = dict()
+        
+    def __len__(self):
+        return len(self.identities)
+    
+    def __getitem__(self, number):
+        return self.identities[number]
+    
+    def intern(self, id_):
+        '''
+        Return id of identity *id_*, register it if new.
+        '''
+        key = str(id_)
+        try:
+            return self._numbers[key]
+        except KeyError:
+            number = self._numbers[key] = len(self.identities)
+            self.identities.append(id_)
+            return number
+        
+    def lookup(self, id_):
+        '''
+        Return registered identity equal to *id_*. *id_* is either identity or
+        its string, which is parsed only when not registered yet.
+        '''
+        try:
+            return self.identities[self._numbers[str(id_)]]
+        except KeyError:
+            if isinstance(id_, basestring):
+                id_ = Identity.str2id(id_)
+            return self.identities[self.intern(id_)]
+        
+    def ids2bits(self, id_ls):
+        '''
+        Return bitset of identities (or their strings) *id_ls*.
+        '''
+        bits = 0
+        for id_ in id_ls:
+            bits |= 1 << self.intern(self.lookup(id_))
+        return bits
+    
+    def bits2ids(self, bits):
+        '''
+        Return list of identities of bitset *bits* in the order of ids.
+        '''
+        id_ls = []
+        while bits:
+            low = bits & -bits
+            id_ls.append(self.identities[low.bit_length() - 1])
+            bits ^= low
+        return id_ls
+    
+    def imp2bits(self, imp):
+        '''
+        Return (premise, conclusion) bitsets of implication *imp*.
+        '''
+        return self.ids2bits(imp.premise), self.ids2bits(imp.conclusion)
+
+# Process-wide registry, see Identity.number
+registry = IdentityRegistry()
+
+def parse_term(str_):
     """
-    Extract functional symbols from functional string. Functional symbols should
-    look like 'f{}_{}'.format(n, name), where *n* is the arity, name is the name,
-    name is optional. If arity is more than 0, then '(' follows the name,
-    nullary function ends with name. 
+    Parse term written either with 'a', '-x', 'x*y' for f0, f1(x), f2(x,y)
+    (e.g. 'a*(-x)') or with functional symbols (e.g. 'f2(f0,f1(x))'). The
+    syntaxes may be mixed, spaces are ignored, '-' binds tighter than '*' and
+    '*' is left associative.
+    
+    @return: tree, variables and 'f0' are strings, applications are tuples
+    (name, arg1, ...).
     """
-    return [x.group() for x in re.finditer(r"(?<!\w)f[0-9]\w*", func_str)]
+    str_ = ''.join(str_.split())
+    try:
+        tree, pos = _parse_product(str_, 0)
+    except IndexError:
+        pos = len(str_) + 1
+    if pos != len(str_):
+        raise ParseError('Cannot parse term {0}'.format(str_))
+    return tree
 
-def _get_var_symbols(func_str):
+def _parse_product(str_, pos):
+    tree, pos = _parse_operand(str_, pos)
+    while pos < len(str_) and str_[pos] == '*':
+        right, pos = _parse_operand(str_, pos + 1)
+        tree = ('f2', tree, right)
+    return tree, pos
+
+def _parse_operand(str_, pos):
     """
-    Extract variable symbols from functional string. Variable symbols are:
-    'x', 'y', 'z', 'w'.
+    Parse variable, constant, application of function, or unary minus.
     """
-    return [x.group() for x in re.finditer(r"(?<!\w)[w-z]", func_str)]
-    
-def generate_ts(len_limit, num_vars=1):
+    c = str_[pos]
+    if c in 'xyzw':
+        return c, pos + 1
+    elif c == 'f':
+        arity = str_[pos + 1]
+        if arity == '0':
+            return 'f0', pos + 2
+        elif arity == '1' and str_[pos + 2] == '(':
+            arg, pos = _parse_product(str_, pos + 3)
+            if str_[pos] == ')':
+                return ('f1', arg), pos + 1
+        elif arity == '2' and str_[pos + 2] == '(':
+            left, pos = _parse_product(str_, pos + 3)
+            if str_[pos] == ',':
+                right, pos = _parse_product(str_, pos + 1)
+                if str_[pos] == ')':
+                    return ('f2', left, right), pos + 1
+    elif c == '-':
+        tree, pos = _parse_operand(str_, pos + 1)
+        return ('f1', tree), pos
+    elif c == 'a':
+        return 'f0', pos + 1
+    elif c == '(':
+        tree, pos = _parse_product(str_, pos + 1)
+        if str_[pos] == ')':
+            return tree, pos + 1
+    raise ParseError('Unexpected {0} at {1} in {2}'.format(str_[pos], pos,
+                                                        str_))
+
+def _tree2func_str(tree):
+    """
+    Make functional string from tree returned by parse_term.
+    """
+    if isinstance(tree, str):
+        return tree
+    elif len(tree) == 3:
+        return (tree[0] + '(' + _tree2func_str(tree[1]) + ',' +
+                _tree2func_str(tree[2]) + ')')
+    return tree[0] + '(' + _tree2func_str(tree[1]) + ')'
+
+_symbols_re = re.compile(r"(?<!\w)(?:f[0-9]\w*|[w-z])")
+
+def _rename_vars(func_str):
+    """
+    Rename variables in functional string to 'x', 'y', 'z', 'w' in the order
+    of their first occurrence.
+    """
+    names = {}
+    def rename(match):
+        var = match.group()
+        if not var in names:
+            names[var] = 'xyzw'[len(names)]
+        return names[var]
+    return re.sub(r"(?<!\w)[w-z]", rename, func_str)
+
+def generate_ts(len_limit, num_vars=1, lazy=False):
     '''
-    Generates terms of size len_limit. Size := length(ops_list) + 
-                                               length(vars_list).
+    Generates terms of size len_limit. Size := number of operations and
+    variables in the term, nullary *f0* counts as an operation. Every term
+    with variables from the first *num_vars* of 'x', 'y', 'z', 'w' is
+    generated exactly once.
                                                
     @param len_limit: length limit of term.
+    @param lazy: if True return generator instead of list.
     @return: list of Terms.
     '''
-    def orders_types_product(orders_ls, types_ls):
-        '''
-        If type is 0 corresponding order is changed to 0.
-        '''
-        result = []
-        for types in types_ls:
-            nul_inds = [i for i, x in enumerate(types) if x == 0]
-            for orders in orders_ls:
-                cor_orders = orders[:]
-                for i in nul_inds:
-                    cor_orders[i] = 0
-                result.append((cor_orders, types))
-        return result
-    
-    num_types = 3
-    ops_ls = []
-    els_ords_types = []
-    for len_ops in xrange(len_limit + 1):
-        types_ls = [list(i) for i in
-                     itertools.product(*itertools.repeat(range(num_types),
-                                                        len_ops))]
-        orders_ls = [list(i) for i in
-                      itertools.permutations(range(1, len_ops+1), len_ops)]
-        new_ops = orders_types_product(orders_ls, types_ls)
-        ops_ls += new_ops  
-    for ops in ops_ls:
-        len_ops = len(ops[1]) - len(filter(lambda x: x == 0, ops[1]))
-        elems_ls = [list(i) for i in 
-                    itertools.product(*itertools.repeat(range(num_vars),
-                                                        len_limit - len_ops))]
-        els_ords_types += [(els, ops[0], ops[1])
-                           for els in elems_ls
-                           if (len(els) ==
-                               1 + len(filter(lambda x: x == 2, ops[1])))]
-    
-    result = []
-    for (elems, order, types) in els_ords_types:
-        term = Term.parsed2term(('', len(elems), len(order),
-                                 elems, order, types))
-        term.name = term.func_str
-        if not (term in result):
-            result.append(term)
-    
-    return result
+    terms = (Term(func_str, func_str)
+             for func_str in _term_strs(len_limit, 'xyzw'[:num_vars], {}))
+    if lazy:
+        return terms
+    return list(terms)
+
+def _term_strs(size, var_symbols, known):
+    '''
+    Iterate over functional strings of terms of given size. Order: variables,
+    f0, then f1(t), then f2(l, r) by the size of l. *known* holds lists of
+    smaller terms already produced.
+    '''
+    if size == 1:
+        for var in var_symbols:
+            yield var
+        yield 'f0'
+        return
+    elif size < 1:
+        return
+    def smaller(n):
+        if not n in known:
+            known[n] = list(_term_strs(n, var_symbols, known))
+        return known[n]
+    for t in smaller(size - 1):
+        yield 'f1(' + t + ')'
+    for left_size in xrange(1, size - 1):
+        for left in smaller(left_size):
+            for right in smaller(size - 1 - left_size):
+                yield 'f2(' + left + ',' + right + ')'
     
 def generate_ids(len_limit, num_vars=2):
     '''
@@ -287,10 +665,10 @@ def generate_ids(len_limit, num_vars=2):
     @param len_limit: length limit of identity.
     @return: list of identites.
     '''
-    def not_equivalent(ids, left_term, right_term):
+    def not_equivalent(keys, left_term, right_term):
         '''
-        True if among ids there is no equivalent identity to left_term \equiv
-        right_term, otherwise False.
+        True if among canonical keys of identities *keys* there is no key of
+        identity equivalent to left_term \equiv right_term, otherwise False.
         '''
         for var in 'xyzw':
             # equiv if either term is single variable not occuring in other term
@@ -308,21 +686,11 @@ def generate_ids(len_limit, num_vars=2):
                    left_term.func_str.strip('').startswith('f1(') and
                    not var in left_term.func_str)):
                 return False
-        str_ids = map(str, ids)
-        str_new_id1 = left_term.func_str + ' = ' + right_term.func_str
-        str_new_id2 = right_term.func_str + ' = ' + left_term.func_str
-        vars_perms = map(''.join, itertools.permutations('xyzw', 4))
-        for to in vars_perms:
-            # filter out if equivalent from permutation of variables
-            trans_table = maketrans('xyzw', to)
-            equiv_id1 = str_new_id1.translate(trans_table)
-            equiv_id2 = str_new_id2.translate(trans_table)
-            if (equiv_id1 in str_ids or
-                equiv_id2 in str_ids):
-                return False
-        return True
+        # filter out if equivalent from permutation of variables
+        return not Identity(left_term, right_term).canonical_key in keys
         
     result = []
+    keys = set()
     terms_ls = [generate_ts(length, num_vars) for length in range(1, len_limit)]
     for len_left_term in xrange(len_limit / 2):
         len_right_term = len_limit - len_left_term - 2
@@ -331,17 +699,111 @@ def generate_ids(len_limit, num_vars=2):
                 for j in xrange(i + 1, len(terms_ls[len_right_term])):
                     left_term = terms_ls[len_right_term][i]
                     right_term = terms_ls[len_right_term][j]
-                    if not_equivalent(result, left_term, right_term):
+                    if not_equivalent(keys, left_term, right_term):
                         new_id = Identity(left_term, right_term)
                         result.append(new_id)
+                        keys.add(new_id.canonical_key)
         else:
             for left_term in terms_ls[len_left_term]:
                 for right_term in terms_ls[len_right_term]:
-                    if not_equivalent(result, left_term, right_term):
+                    if not_equivalent(keys, left_term, right_term):
                         new_id = Identity(left_term, right_term)
-                        result.append(Identity(left_term, right_term))
+                        result.append(new_id)
+                        keys.add(new_id.canonical_key)
     return result
 
+def known_implications(id_ls):
+    '''
+    Implications between identities of *id_ls* valid in every algebra:
+    identities with equal canonical keys imply each other and 'x = y' implies
+    everything.
+    
+    @return: list of (premise, conclusion) pairs of lists of identities
+    '''
+    classes = dict()
+    for id_ in id_ls:
+        classes.setdefault(id_.canonical_key, []).append(id_)
+    imps = []
+    for key, class_ in classes.items():
+        if key == 'x = y':
+            imps += [([id_], list(id_ls)) for id_ in class_]
+        elif len(class_) > 1:
+            imps += [([id_], class_) for id_ in class_]
+    return imps
+
+####################################IDENTITY FILES
+_CACHE_VERSION = 2
+
+def read_ids(path, cache=True):
+    '''
+    Read identities in functional syntax from *path*, one per line.
+    
+    Parsed terms (strings, symbols and compiled code) are kept in the binary
+    file *path* + '.cache' keyed on sha1 of the source and on the bytecode
+    magic number of the interpreter, so that the next read of unchanged file
+    does not parse anything. The cache is rebuilt when the source or the
+    interpreter changes. Equal terms are stored once and shared by identities, as
+    in generate_ids.
+    
+    @param cache: if False, neither read nor write the cache
+    @return: list of identities
+    '''
+    with open(path, 'rb') as f_ids:
+        source = f_ids.read()
+    digest = hashlib.sha1(source).hexdigest()
+    cache_path = path + '.cache'
+    if cache:
+        cached = _read_ids_cache(cache_path, digest)
+        if cached is not None:
+            records, pairs = cached
+            terms = [Term._restore(*record) for record in records]
+            return [Identity(terms[left], terms[right])
+                    for left, right in pairs]
+    id_ls = [Identity.func_str2id(line) for line in source.splitlines()]
+    if cache:
+        _write_ids_cache(cache_path, digest, id_ls)
+    return id_ls
+
+def _read_ids_cache(cache_path, digest):
+    """
+    Return (term records, pairs of term numbers) stored in cache file if it
+    was made for source with sha1 *digest* by an interpreter with the same
+    bytecode magic number, else None.
+    """
+    try:
+        with open(cache_path, 'rb') as f_cache:
+            version, magic, cached_digest, records, pairs = marshal.loads(
+                f_cache.read())
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
+    if (version != _CACHE_VERSION or magic != imp.get_magic() or
+            cached_digest != digest):
+        return None
+    return records, pairs
+
+def _write_ids_cache(cache_path, digest, id_ls):
+    """
+    Store terms of identities *id_ls* in cache file, unwritable location is
+    ignored.
+    """
+    numbers = dict()
+    records = []
+    pairs = []
+    for id_ in id_ls:
+        pair = []
+        for term in (id_.left_term, id_.right_term):
+            if not term.func_str in numbers:
+                numbers[term.func_str] = len(records)
+                records.append(term._record())
+            pair.append(numbers[term.func_str])
+        pairs.append(tuple(pair))
+    try:
+        with open(cache_path, 'wb') as f_cache:
+            f_cache.write(marshal.dumps((_CACHE_VERSION, imp.get_magic(),
+                                         digest, records, pairs)))
+    except IOError:
+        pass
+
 ########################################################
 if __name__ == '__main__':
     def print_ids(length, num_vars):
@@ -3,64 +3,172 @@ Created on May 13, 2013
 
 @author: artem
 '''
+import multiprocessing
+import threading
+
 import fca
+import numpy as np
 
 import auto_ae.ae as ae
 
 from bunny import *
 import identity
 import p9m4
+import prover_cache
+import vectorized
 
 #####################Some necessary definitions to start########################
-def read_ids(path):
+def read_ids(path, cache=True):
+    """
+    Reads identities from given path. One identity per line. Parsed
+    identities are cached next to the file, see identity.read_ids.
     """
-    Reads identities from given path. One identity per line.
+    return identity.read_ids(path, cache)
+
+def init_cxt(size, id_ls, batch_size=None, incremental=False, processes=None,
+             implications=None):
+    """
+    Make context of all bunnies of given size and identities from *id_ls*.
+    
+    @param batch_size: if given, rows are computed by batches of that many
+    bunnies at once, see vectorized.satisfaction_matrix. Only the first of the
+    bunnies with equal rows is kept then.
+    @param incremental: if True, rows are updated from the previous bunny by
+    IncrementalChecker
+    @param processes: if given, bunnies are split into ranges computed by a
+    pool of that many processes (in batches of *batch_size*, 10000 by
+    default), rows are merged in the order of bunnies(size).
+    @param implications: if given, rows are filled by RowFiller with these
+    valid implications and identity.known_implications(id_ls), identities
+    following from the ones already holding are not evaluated
     """
-    id_ls = []
-    with open(path, 'r') as f_ids:
-        for line_id in f_ids:
-            new_id = identity.Identity.func_str2id(line_id)
-            id_ls.append(new_id)
-    return id_ls
-
-def init_cxt(size, id_ls):
+    if processes:
+        return _init_cxt_parallel(size, id_ls, processes, batch_size or 10000)
+    if batch_size:
+        return _init_cxt_batched(size, id_ls, batch_size)
     obj_ls = []
     att_ls = id_ls
     table = []
-    for bun in bunnies(size):
-        obj_ls.append(repr(bun))
-        row = [bun.check_id(id_) for id_ in id_ls]
-        table.append(row)
+    if incremental:
+        odo = TableOdometer(size)
+        checker = IncrementalChecker(odo, id_ls)
+        for index in odo:
+            checker.update()
+            obj_ls.append('show(index={}, size={})'.format(index, size))
+            table.append(checker.row())
+    elif implications is not None:
+        filler = RowFiller(id_ls, list(implications) +
+                           identity.known_implications(id_ls))
+        for bun in bunnies(size):
+            obj_ls.append(repr(bun))
+            table.append(filler.fill(bun))
+    else:
+        for bun in bunnies(size):
+            obj_ls.append(repr(bun))
+            row = [bun.check_id(id_) for id_ in id_ls]
+            table.append(row)
     cxt = fca.Context(table, obj_ls, map(str, att_ls))
     return cxt.reduce_objects()
 
+def _init_cxt_batched(size, id_ls, batch_size):
+    indices, rows = vectorized.distinct_rows(size, id_ls, batch_size)
+    return _rows2cxt(size, id_ls, [(indices, rows)])
+
+def _init_cxt_parallel(size, id_ls, processes, batch_size):
+    total = size ** (size**2 + size)
+    step = max(1, -(-total // (processes * 4)))
+    func_strs = [id_.func_str for id_ in id_ls]
+    shards = [(size, func_strs, batch_size, start, min(start + step, total))
+              for start in xrange(0, total, step)]
+    pool = multiprocessing.Pool(processes)
+    try:
+        shard_rows = pool.map(_cxt_shard, shards)
+    finally:
+        pool.close()
+        pool.join()
+    return _rows2cxt(size, id_ls, shard_rows)
+
+def _cxt_shard(args):
+    size, func_strs, batch_size, start, stop = args
+    id_ls = map(identity.Identity.func_str2id, func_strs)
+    return vectorized.distinct_rows(size, id_ls, batch_size, start, stop)
+
+def _rows2cxt(size, id_ls, shard_rows):
+    """
+    Merge (indices, packed rows) of consecutive shards into reduced context.
+    """
+    obj_ls = []
+    table = []
+    seen = set()
+    for indices, rows in shard_rows:
+        for index, row in zip(indices, rows):
+            if row in seen:
+                continue
+            seen.add(row)
+            obj_ls.append('show(index={}, size={})'.format(index, size))
+            bits = np.unpackbits(np.fromstring(row, dtype=np.uint8))
+            table.append(map(bool, bits[:len(id_ls)]))
+    cxt = fca.Context(table, obj_ls, map(str, id_ls))
+    return cxt.reduce_objects()
+
 dest = '../etc/test_run'
-def ce_finder(imp, wait):
+# results of Prover9 and Mace4 kept between runs, created on first use
+_prover_cache = None
+
+def ce_finder(imp, wait, race=True, race_inf=False):
+    """
+    Prove implication *imp* or find counter-example to it.
+    
+    @param race: if True, Prover9 and Mace4 run at once and the first
+    decisive answer is taken, see p9m4.race. Otherwise Prover9 runs first
+    and Mace4 only if the implication is not proved.
+    @param race_inf: if True, search for infinite bunny joins the race,
+    otherwise it runs after the provers fail.
+    """
+    global _prover_cache
+    if _prover_cache is None:
+        _prover_cache = prover_cache.ProverCache(dest + '/provers.sqlite')
+    cache = _prover_cache
+    prover9_imp = imp
     if any(str(id_) == 'x = y' for id_ in imp.conclusion):
-        old_conclusion = imp._conclusion.copy()
-        imp._conclusion = {id_ for id_ in imp.conclusion if str(id_) == 'x = y'} 
-        proved = p9m4.prover9(imp, dest  + '/ces', wait / 100.)
-        imp._conclsuion = old_conclusion
+        # x = y implies everything, prove it alone
+        prover9_imp = fca.Implication(imp.premise,
+                                      {id_ for id_ in imp.conclusion
+                                       if str(id_) == 'x = y'})
+    def find_inf(stop=None):
+        premise = map(identity.registry.lookup, imp.premise)
+        conclusion = map(identity.registry.lookup, imp.conclusion)
+        id_imp = fca.Implication(premise, conclusion)
+        with _inf_lock:
+            if stop is not None and stop.is_set():
+                # race decided while waiting for the lock
+                return None, 'No infinite bunny found - race decided'
+            return InfBunny.find(id_imp, wait, kern_size=3, stop=stop)
+    if race:
+        contenders = [find_inf] if race_inf else []
+        proved, found, reason = p9m4.race(imp, wait / 100., cache=cache,
+                                          prover9_imp=prover9_imp,
+                                          contenders=contenders)
     else:
-        proved = p9m4.prover9(imp, dest  + '/ces', wait / 100.)
+        proved = p9m4.prover9(prover9_imp, wait_time=wait / 100., cache=cache)
+        found = None
+        if not proved:
+            found, reason = p9m4.mace4(imp, wait_time=wait / 100., cache=cache)
     if proved == True:
         ans = (None, 'Implication proved.')
+    elif not found == None:
+        ans = (found, reason)
+    elif race and race_inf:
+        ans = (None, reason)
     else:
-        found, reason = p9m4.mace4(imp, dest  + '/ces', wait / 100.)
-        if not found == None:
-            ans = (found, reason)
-            #premise = map(lambda x: identity.Identity.func_str2id(x), imp.premise)
-            #conclusion = map(lambda x: identity.Identity.func_str2id(x), imp.conclusion)
-        else:
-            premise = map(lambda x: identity.Identity.func_str2id(x), imp.premise)
-            conclusion = map(lambda x: identity.Identity.func_str2id(x), imp.conclusion)
-            id_imp = fca.Implication(premise, conclusion)
-            bun, reason = InfBunny.find(id_imp, wait, kern_size=3)
-            ans = (bun, reason)
+        ans = find_inf()
     return ans
 
+# InfBunny search uses class-level state, one search at a time
+_inf_lock = threading.Lock()
+
 def has_attribute(object_repr, attr_name):
-    id_ = identity.Identity.func_str2id(attr_name)
+    id_ = identity.registry.lookup(attr_name)
     bun = eval(object_repr)
     limit = None
     if type(bun) == InfBunny:
@@ -1,203 +1,348 @@
 """
 Holds functions for running Prover9 and Mace4 with some input.
 
-@attention: subprocesses for prover9 and mace4 are created on a separate socket "P9M4". It is necessary to launch the socket first.
+Prover9 and Mace4 run as subprocesses of a ProverPool (see prover_pool), by
+default of the pool shared by the module with one job per CPU. *_job
+functions return the running Job, so that many searches may be in flight at
+once, prover9 and mace4 wait for the result.
+
+The problem is written to stdin of the prover and the output is read from its
+stdout, no files are used unless *file_path* is given: then the input and the
+output are also dumped to file_path + '.in' and file_path + '.mace4.out' (or
+'.prover9.out') for debugging.
 """
-import subprocess
 import os
-import shutil
-import rfoo
+import Queue
+import re
+import threading
 
 import fca
 
 import bunny
+import prover_pool
+
+# Seconds given to a job above the time limit of the prover before it is
+# killed
+KILL_MARGIN = 5
 
-def mace4(imp, file_path, wait_time=1):
+def problem(imp):
     """
-    Runs Mace4 with implication as theorems to reject.
-    
-    @param imp: implication
-    @param file_path: name of (input and output) files for Mace4
-    @param wait_time: time constraint for mace4
-    @return: (counter-example, reason)
+    Return input for Prover9/Mace4 with implication: premise as assumptions,
+    conjunction of the conclusion as goal.
     """
     sos = 'formulas(sos).\n'
     goals = 'formulas(goals).\n'
     eol = 'end_of_list.\n\n'
     
-    file_name = (file_path + r'.in')
-    with open(file_name, 'w') as file:
-        if imp.premise:
-            file.write(sos)
-            file.write('\t' + '.\n\t'.join(str(k) for k in imp.premise) + '.\n')
-            file.write(eol)
-
-        file.write(goals)
-        file.write('\t')
-        file.write('(' + ') & ('.join(str(j) for j in imp.conclusion) + ').\n')
-        file.write(eol)
-    file.close()
-
-    output = (file_path + r'.mace4.out')
-    call_str = 'mace4 -t {0} -N 75 -f '.format(wait_time)
-    call_str += file_name + ' > ' + output
+    text = ''
+    if imp.premise:
+        text += sos
+        text += '\t' + '.\n\t'.join(str(k) for k in imp.premise) + '.\n'
+        text += eol
+    text += goals
+    text += '\t'
+    text += '(' + ') & ('.join(str(j) for j in imp.conclusion) + ').\n'
+    text += eol
+    return text
+
+def _submit(args, imp, file_path, suffix, wait_time, pool, callback):
+    text = problem(imp)
+    output = None
+    if file_path is not None:
+        with open(file_path + r'.in', 'w') as f_in:
+            f_in.write(text)
+        output = file_path + suffix
+    if pool is None:
+        pool = prover_pool.default_pool()
+    return pool.submit(args, stdout=output, timeout=wait_time + KILL_MARGIN,
+                       callback=callback, input=text, capture=True)
+
+def mace4_job(imp, file_path=None, wait_time=1, pool=None):
+    """
+    Start Mace4 with implication as theorems to reject.
+    
+    @param imp: implication
+    @param file_path: if given, prefix of the files to dump input and output
+    @param wait_time: time constraint for mace4
+    @param pool: ProverPool, default_pool() if None
+    @return: Job, its result is (counter-example, reason) as in mace4
+    """
+    args = ['mace4', '-t', str(wait_time), '-N', '75']
+    return _submit(args, imp, file_path, r'.mace4.out', wait_time, pool,
+                   _mace4_result)
+
+def _mace4_result(job):
+    output_code = job.returncode
     ce = None
     reason = None
-#     with open(os.devnull, "w") as fnull:
-#         output_code = subprocess.call(call_str, shell=True, stdout=fnull, stderr=fnull)
     # Process output codes in to reasons
-    c = rfoo.UnixConnection().connect('P9M4')
-    output_code = rfoo.Proxy(c).RPopen(call_str)
-    if output_code == 2:
+    if job.status == 'cancelled':
+        reason = 'Cancelled'
+    elif output_code == 2:
         # not found
         reason = 'Search complete with no models'
-        os.remove(output)
-    elif output_code == 5:
+    elif output_code == 5 or job.status == 'timeout':
         # not found
         reason = 'Timeout'
-        os.remove(output)
     elif output_code == 0:
         # found 
-        ce = read_model(output)
+        ce = parse_model(job.output.splitlines(True))
     else:
         raise Exception, 'Unexpected output code {0} from Mace4'.format(output_code)
-    os.remove(file_name)
     return (ce, reason)
 
-def prover9(imp, file_path, wait_time=1):
+def mace4(imp, file_path=None, wait_time=1, pool=None, cache=None):
+    """
+    Runs Mace4 with implication as theorems to reject.
+    
+    @param imp: implication
+    @param file_path: if given, prefix of the files to dump input and output
+    @param wait_time: time constraint for mace4
+    @param pool: ProverPool, default_pool() if None
+    @param cache: ProverCache, Mace4 is run only if the result is not cached
+    @return: (counter-example, reason)
+    """
+    if cache is not None:
+        cached = cache.get('mace4', imp, wait_time)
+        if cached is not None:
+            status, ce = cached
+            return ce, _CACHED_REASONS[status]
+    ce, reason = mace4_job(imp, file_path, wait_time, pool).result()
+    if cache is not None and reason != 'Cancelled':
+        _cache_mace4(cache, imp, wait_time, ce, reason)
+    return ce, reason
+
+def _cache_mace4(cache, imp, wait_time, ce, reason):
+    if ce is not None:
+        cache.put('mace4', imp, wait_time, 'model', ce)
+    elif reason == 'Timeout':
+        cache.put('mace4', imp, wait_time, 'timeout')
+    else:
+        cache.put('mace4', imp, wait_time, 'no_models')
+
+_CACHED_REASONS = {'model': None,
+                   'no_models': 'Search complete with no models',
+                   'timeout': 'Timeout'}
+
+def prover9_job(imp, file_path=None, wait_time=1, pool=None):
+    """
+    Start Prover9 with implication as theorem to prove.
+    
+    @param imp: implication
+    @param file_path: if given, prefix of the files to dump input and output
+    @param wait_time: time constraint for Prover9
+    @param pool: ProverPool, default_pool() if None
+    @return: Job, its result is True or False as in prover9
+    """
+    args = ['prover9', '-t', str(wait_time)]
+    return _submit(args, imp, file_path, r'.prover9.out', wait_time, pool,
+                   _prover9_result)
+
+def _prover9_result(job):
+    # proved iff exit code is 0
+    return job.returncode == 0
+
+def prover9(imp, file_path=None, wait_time=1, pool=None, cache=None):
     """
     Runs Prover9 with implication as theorem to prove.
     
     @param imp: implication
-    @param file_path: name of (input and output) files for Prover9
+    @param file_path: if given, prefix of the files to dump input and output
     @param wait_time: time constraint for Prover9
+    @param pool: ProverPool, default_pool() if None
+    @param cache: ProverCache, Prover9 is run only if the result is not
+    cached, not proved is cached as timeout
     @return: True or False
     """
-    sos = 'formulas(sos).\n'
-    goals = 'formulas(goals).\n'
-    eol = 'end_of_list.\n\n'
-    
-    file_name = (file_path + r'.in')
-    with open(file_name, 'w') as file:
-        if imp.premise:
-            file.write(sos)
-            file.write('\t' + '.\n\t'.join(str(k) for k in imp.premise) + '.\n')
-            file.write(eol)
-
-        file.write(goals)
-        file.write('\t')
-        file.write('(' + ') & ('.join(str(j) for j in imp.conclusion) + ').\n')
-        file.write(eol)
-    file.close()
-
-    output = (file_path + r'.prover9.out')
-    call_str = 'prover9 -t {0} -f '.format(wait_time)
-    call_str += file_name + ' > ' + output
-    #with open(os.devnull, "w") as fnull:
-        #output_code = subprocess.call(call_str, shell=True, stdout=fnull, stderr=fnull)
-    # Process output codes in to reasons
-    c = rfoo.UnixConnection().connect('P9M4')
-    output_code = rfoo.Proxy(c).RPopen(call_str)
-    if output_code != 0:
-        # not proved
-        os.remove(output)
-        proved = False
-    else:
-        # proved
-        proved = True
-    os.remove(file_name)
+    if cache is not None:
+        cached = cache.get('prover9', imp, wait_time)
+        if cached is not None:
+            return cached[0] == 'proved'
+    job = prover9_job(imp, file_path, wait_time, pool)
+    proved = job.result()
+    if cache is not None and job.status != 'cancelled':
+        _cache_prover9(cache, imp, wait_time, proved)
     return proved
 
+def _cache_prover9(cache, imp, wait_time, proved):
+    cache.put('prover9', imp, wait_time, 'proved' if proved else 'timeout')
 
-def read_model(path):
+def race(imp, wait_time=1, pool=None, cache=None, prover9_imp=None,
+         contenders=()):
     """
-    Extracting models from *.mace4.out files
+    Run Prover9 and Mace4 at once and return the first decisive answer:
+    proof by Prover9 or counter-example by Mace4 or by a contender. The
+    provers still running then are killed.
     
-    @return: bunny object
+    @param prover9_imp: implication for Prover9 if it differs from *imp*
+    @param contenders: functions of threading.Event returning
+    (counter-example, reason) like mace4, run in threads alongside. The
+    event is set when the race is decided, the contenders still running
+    should return soon after.
+    @param cache: ProverCache, cached results are used instead of running
+    the prover, results of provers not killed are stored
+    @return: (proved, counter-example, reason), reason of the last finished
+    counter-example search if nothing was decided
+    """
+    if prover9_imp is None:
+        prover9_imp = imp
+    answers = Queue.Queue()
+    jobs = []
+    def start(engine, job_func, job_imp):
+        if cache is not None:
+            cached = cache.get(engine, job_imp, wait_time)
+            if cached is not None:
+                status, ce = cached
+                if engine == 'prover9':
+                    answers.put((engine, None, status == 'proved'))
+                else:
+                    answers.put((engine, None, (ce, _CACHED_REASONS[status])))
+                return
+        job = job_func(job_imp, None, wait_time, pool)
+        jobs.append(job)
+        _in_thread(answers, engine, job, job.result)
+    start('prover9', prover9_job, prover9_imp)
+    start('mace4', mace4_job, imp)
+    stop = threading.Event()
+    for contender in contenders:
+        _in_thread(answers, 'contender', None,
+                   lambda contender=contender: contender(stop))
+    reason = None
+    try:
+        for _ in xrange(2 + len(contenders)):
+            engine, job, answer = answers.get()
+            if engine == 'prover9':
+                if cache is not None and job is not None:
+                    _cache_prover9(cache, prover9_imp, wait_time, answer)
+                if answer:
+                    return True, None, None
+                continue
+            ce, reason = answer
+            if cache is not None and job is not None:
+                _cache_mace4(cache, imp, wait_time, ce, reason)
+            if ce is not None:
+                return False, ce, reason
+    finally:
+        stop.set()
+        for job in jobs:
+            job.cancel()
+    return False, None, reason
+
+def _in_thread(answers, engine, job, func):
+    """
+    Put (engine, job, func()) to *answers* from a new thread, failure of
+    *func* is put as not proved or not found.
+    """
+    def put_answer():
+        try:
+            answers.put((engine, job, func()))
+        except Exception, e:
+            # not cached
+            if engine == 'prover9':
+                answers.put((engine, None, False))
+            else:
+                answers.put((engine, None, (None, 'Error: {0}'.format(e))))
+    thread = threading.Thread(target=put_answer)
+    thread.daemon = True
+    thread.start()
+
+
+def read_model(path, compact=False):
+    """
+    Extracting model from *.mace4.out file
+    
+    @param compact: if True return bunny.CompactBunny
+    @return: bunny object, None if there is no model
     """
     with open(path) as MF:
-        FileText = MF.readlines()
-    MF.close()
-    # Finding Model
-    LengthFile = len(FileText)
-    for i in range(LengthFile):
-        if (FileText[i].find( r'MODEL' ) != -1): break
-    ModelStrInd = i
-    # Reading domain
-    for i in range(ModelStrInd+1, LengthFile):
-        if (FileText[i].find( r'interpretation' ) != -1): break
-    DomStrInd = i
-    for i in FileText[DomStrInd]:
-        if i.isdigit():
-            Dom = int(i)
-            break
-    # Reading multiplication table
-    found = False
-    for i in range(ModelStrInd+1, LengthFile):
-        if (FileText[i].find( r'(_,_)' ) != -1):
-            found = True
-            break
-    B = dict([(i, j), None]
-             for i in range(Dom)
-             for j in range(Dom))
-    NumB = 0
-    if found:
-        FunStrInd = i
-        wstr = ''
-        for i in range(Dom):
-            wstr += FileText[FunStrInd+i+1]
-        count = 0
-        for i in wstr:
-            if i.isdigit():
-                B[count/Dom, count%Dom] = int(i)
-                count += 1
-        # Calculating Numj
-        for i in range(Dom):
-            for j in range(Dom):
-                NumB += B[i, j] * Dom**(i + j*Dom)
-    else:
-        B = dict([(i, j), 0] for i in range(Dom) for j in range(Dom))
-    # Reading unary table
-    found = False
-    for i in range(ModelStrInd+1, LengthFile):
-        if (FileText[i].find( r'(_)' ) != -1):
-            found = True
-            break
-    U = dict([i, None] for i in range(Dom))
-    NumU = 0
-    if found:
-        InvStrInd = i
-        wstr = FileText[InvStrInd]
-        count = 0
-        for i in wstr[wstr.find('['):]:
-            if i.isdigit():
-                U[count] = int(i)
-                count += 1
-        # Calculating NumU
-        for i in range(Dom):
-            NumU += U[i] * Dom**(i)
-    else:
-        U = dict([i, 0] for i in range(Dom))
-    # Reading constant
-    found = False
-    for i in range(ModelStrInd+1, LengthFile):
-        if (FileText[i].find( r'function(f0' ) != -1):
-            found = True
-            break
-    NumN = N = 0
-    if found:
-        ConstStrInd = i
-        wstr = FileText[ConstStrInd]
-        for i in wstr:
-            if i.isdigit():
-                NumN = N = int(i)
-                
-    # prepare return and return
-    index = NumB + NumU*(Dom ** (Dom**2)) + NumN*(Dom ** (Dom**2 + Dom))
-    bun = bunny.Bunny.dicts2bunny(B, U, N, index)
-    return bun
-
-def read_all_models(dest):
+        return parse_model(MF, compact)
+
+def parse_model(lines, compact=False):
+    """
+    Extracting the first model from lines of Mace4 output
+    
+    @param compact: if True return bunny.CompactBunny
+    @return: bunny object, None if there is no model
+    """
+    return next(iter_models(lines, compact), None)
+
+_domain_re = re.compile(r"interpretation\(\s*(\d+)")
+_function_re = re.compile(r"function\(\s*([^\s(,]+)\s*(\([_,\s]*\))?\s*,"
+                          r"\s*\[([\d,\s]*)\]")
+# Mace4 names of the skolem constants of the denied goal
+_skolem_re = re.compile(r"c\d+$")
+
+def iter_models(lines, compact=False):
+    """
+    Iterate over models in Mace4 output given by iterable of lines (file,
+    pipe, list). Every interpretation block is read once and parsed as a
+    whole, domain and values of any size are allowed. Tables are found by
+    arity, so both functional ('f2', 'f1', 'f0') and surface ('*', '-', 'a')
+    symbols are read. Missing f2 or f1 is taken as constant 0.
+    
+    @param compact: if True yield bunny.CompactBunny
+    @return: iterator over bunny objects
+    """
+    block = None
+    for line in lines:
+        if block is None:
+            if line.startswith('interpretation('):
+                block = [line]
+            continue
+        block.append(line)
+        if line.startswith(']).'):
+            yield _block2bunny(''.join(block), compact)
+            block = None
+
+def _block2bunny(text, compact):
+    """
+    Make bunny from text of interpretation block. Binary function is f2,
+    unary is f1, constant 'a' or 'f0' is f0, skolem constants are skipped.
+    Any other function or a second function of the same arity raises
+    ValueError.
+    """
+    size = int(_domain_re.match(text).group(1))
+    tables = dict()
+    for name, args, values in _function_re.findall(text):
+        arity = args.count('_')
+        if arity == 2 or arity == 1:
+            f_name = 'f{}'.format(arity)
+        elif arity == 0 and name in ('a', 'f0'):
+            f_name = 'f0'
+        elif arity == 0 and _skolem_re.match(name):
+            continue
+        else:
+            raise ValueError('Unknown function {} in Mace4 '
+                             'interpretation'.format(name + args))
+        if f_name in tables:
+            raise ValueError('Two functions for {} in Mace4 '
+                             'interpretation'.format(f_name))
+        tables[f_name] = map(int, values.replace(',', ' ').split())
+    f2_vals = tables.get('f2') or [0] * size**2
+    f1_vals = tables.get('f1') or [0] * size
+    f0 = tables['f0'][0] if tables.get('f0') else 0
+    if len(f2_vals) != size**2 or len(f1_vals) != size:
+        raise ValueError('Wrong table size in Mace4 interpretation')
+    # mace4 lists f2(i,j) at position i*size + j, index has f2(i,j) as digit
+    # number i + j*size, then f1(i) as digit number size**2 + i, then f0
+    digits = [f2_vals[i*size + j] for j in xrange(size) for i in xrange(size)]
+    digits += f1_vals
+    digits.append(f0)
+    index = 0
+    for digit in reversed(digits):
+        index = index * size + digit
+    f2_dict = dict(((i, j), f2_vals[i*size + j])
+                   for i in xrange(size) for j in xrange(size))
+    f1_dict = dict(enumerate(f1_vals))
+    if compact:
+        return bunny.CompactBunny.dicts2bunny(f2_dict, f1_dict, f0, index)
+    return bunny.Bunny.dicts2bunny(f2_dict, f1_dict, f0, index)
+
+def read_all_models(dest, up_to_iso=False):
+    """
+    Read all the models from all *mace4* files in directory *dest*, see
+    unique_models for *up_to_iso*.
+    """
     Files = os.listdir(dest)
     MaceFiles = []
     for i in Files:
@@ -205,8 +350,81 @@ def read_all_models(dest):
             MaceFiles.append(i)
     a = []
     for i in MaceFiles:
-        a.append( read_model(dest + r'/' + i) )
-    return a
+        with open(dest + r'/' + i) as MF:
+            a.extend(iter_models(MF))
+    return unique_models(a, up_to_iso)
+
+def unique_models(buns, up_to_iso=False):
+    """
+    Keep the first of equal bunnies from *buns*.
+    
+    @param up_to_iso: if True, isomorphic bunnies are taken as equal, see
+    bunny.canonical_index; bunnies too symmetric for canonical_index are
+    compared as they are
+    """
+    seen = set()
+    ans = []
+    for bun in buns:
+        key = (bun.size, bun.index)
+        if up_to_iso:
+            try:
+                key = (bun.size, 'iso', bunny.canonical_index(bun))
+            except ValueError:
+                pass
+        if not key in seen:
+            seen.add(key)
+            ans.append(bun)
+    return ans
+
+# exit codes of Mace4 with models found: all asked found, search exhausted,
+# time limit, memory limit
+_MODELS_FOUND = (0, 3, 4, 6)
+
+def harvest_job(imp, max_models=10, sizes=None, wait_time=1, pool=None,
+                up_to_iso=False, file_path=None):
+    """
+    Start Mace4 asking for up to *max_models* counter-examples to implication
+    *imp* in one run.
+    
+    @param sizes: (smallest, largest) domain size, (2, 75) if None
+    @param up_to_iso: if True, isomorphic models are reported once
+    @return: Job, its result is list of distinct counter-examples as in
+    harvest
+    """
+    if sizes is None:
+        sizes = (2, 75)
+    args = ['mace4', '-t', str(wait_time), '-m', str(max_models),
+            '-n', str(sizes[0]), '-N', str(sizes[1])]
+    def result(job):
+        return _harvest_result(job, up_to_iso)
+    return _submit(args, imp, file_path, r'.mace4.out', wait_time, pool,
+                   result)
+
+def _harvest_result(job, up_to_iso):
+    if job.output is None:
+        return []
+    if job.status == 'done' and not job.returncode in _MODELS_FOUND:
+        if job.returncode in (2, 5, 7):
+            # no models
+            return []
+        raise Exception, 'Unexpected output code {0} from Mace4'.format(
+            job.returncode)
+    # complete interpretations also when killed
+    return unique_models(iter_models(job.output.splitlines(True)), up_to_iso)
+
+def harvest(imp, max_models=10, sizes=None, wait_time=1, pool=None,
+            up_to_iso=False, file_path=None):
+    """
+    Runs Mace4 once asking for up to *max_models* counter-examples to
+    implication *imp* with domain sizes from *sizes*.
+    
+    @param sizes: (smallest, largest) domain size, (2, 75) if None
+    @param up_to_iso: if True, isomorphic models are reported once
+    @param file_path: if given, prefix of the files to dump input and output
+    @return: list of distinct counter-examples
+    """
+    return harvest_job(imp, max_models, sizes, wait_time, pool, up_to_iso,
+                       file_path).result()
 
 
 ###############################################################################
@@ -0,0 +1,95 @@
+"""
+Holds ProverCache: results of Prover9 and Mace4 calls stored in SQLite file.
+
+Implications are keyed by canonical form: canonical keys (see
+Identity.canonical_key) of premise and conclusion, sorted. So the same
+implication asked with reordered premises or renamed variables is found.
+
+Stored results are 'proved' (Prover9), 'model' (Mace4, the model is kept as
+size and index), 'no_models' (Mace4 search complete) and 'timeout' with the
+time limit used. Timeouts are answered from the cache only for time limits
+not larger than the stored one.
+"""
+import sqlite3
+import threading
+
+import bunny
+import identity
+
+class ProverCache(object):
+    '''
+    Cache of prover results in SQLite file *path*, ':memory:' for cache in
+    memory. Safe to use from several threads.
+    '''
+
+    def __init__(self, path):
+        '''
+        Constructor
+        '''
+        self.path = path
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS results ('
+                             'engine TEXT, imp TEXT, status TEXT, '
+                             'time_limit REAL, size INTEGER, model TEXT, '
+                             'PRIMARY KEY (engine, imp))')
+
+    def close(self):
+        self._db.close()
+
+    def get(self, engine, imp, wait_time):
+        '''
+        Return cached result of *engine* ('prover9' or 'mace4') for
+        implication *imp* with time limit *wait_time*: one of
+        ('proved', None), ('model', bunny), ('no_models', None),
+        ('timeout', None), or None if the prover has to be run.
+        '''
+        with self._lock:
+            row = self._db.execute('SELECT status, time_limit, size, model '
+                                   'FROM results WHERE engine=? AND imp=?',
+                                   (engine, canonical_imp(imp))).fetchone()
+            if row is None or (row[0] == 'timeout' and wait_time > row[1]):
+                self.misses += 1
+                return None
+            self.hits += 1
+        status, _, size, model = row
+        if status == 'model':
+            return status, bunny.show(int(model), size)
+        return status, None
+
+    def put(self, engine, imp, wait_time, status, model=None):
+        '''
+        Store result of *engine* for implication *imp* with time limit
+        *wait_time*, *model* is bunny for status 'model'.
+        '''
+        size = index = None
+        if model is not None:
+            size, index = model.size, str(model.index)
+        key = canonical_imp(imp)
+        with self._lock:
+            with self._db:
+                row = self._db.execute('SELECT status, time_limit FROM results '
+                                       'WHERE engine=? AND imp=?',
+                                       (engine, key)).fetchone()
+                if (status == 'timeout' and row is not None and
+                    (row[0] != 'timeout' or row[1] >= wait_time)):
+                    # keep decisive result or longer timeout
+                    return
+                self._db.execute('INSERT OR REPLACE INTO results '
+                                 'VALUES (?, ?, ?, ?, ?, ?)',
+                                 (engine, key, status, wait_time, size,
+                                  index))
+
+def canonical_imp(imp):
+    '''
+    Return string equal for implications with the same premise and conclusion
+    up to order and renaming of variables in identities. Identities are given
+    as Identity or str.
+    '''
+    def keys(ids):
+        return sorted(set(identity.registry.lookup(id_).canonical_key
+                          for id_ in ids))
+    return ' & '.join(keys(imp.premise)) + ' -> ' + \
+           ' & '.join(keys(imp.conclusion))
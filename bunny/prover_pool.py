@@ -0,0 +1,237 @@
+"""
+Holds ProverPool: runs external provers (Prover9, Mace4) as subprocesses, up
+to given number at once.
+
+Jobs are put in a queue and taken by worker threads, every worker runs one
+subprocess at a time. A job may have a timeout after which its process is
+killed, and may be cancelled. Submitting returns a Job which is waited for
+like a future, so many jobs may be in flight at once.
+
+Usage:
+    pool = ProverPool(4)
+    jobs = [pool.submit(['mace4', '-f', path]) for path in paths]
+    codes = [job.wait() for job in jobs]
+"""
+import atexit
+import multiprocessing
+import os
+import Queue
+import subprocess
+import threading
+
+class Job(object):
+    '''
+    Run of an external program submitted to ProverPool.
+
+    Status is one of 'queued', 'running', 'done', 'timeout', 'cancelled'.
+    *returncode* is the exit code of the program, None if it was killed or
+    did not run.
+    '''
+
+    def __init__(self, args, stdout=None, timeout=None, callback=None,
+                 input=None, capture=False):
+        '''
+        Constructor
+
+        @param args: program and its arguments
+        @param stdout: path of the file for the output of the program, the
+        output is discarded if None and not *capture*
+        @param timeout: seconds after which the program is killed
+        @param callback: function of the finished job giving its result, see
+        result
+        @param input: string written to stdin of the program
+        @param capture: if True, the output is read through pipe into
+        *output* (and also written to *stdout* if given)
+        '''
+        self.args = args
+        self.stdout = stdout
+        self.timeout = timeout
+        self.callback = callback
+        self.input = input
+        self.capture = capture
+        self.status = 'queued'
+        self.returncode = None
+        self.output = None
+        self._process = None
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+
+    def done(self):
+        return self._finished.is_set()
+
+    def wait(self, timeout=None):
+        '''
+        Wait until the job is finished and return its *returncode*.
+
+        @param timeout: seconds to wait, the job keeps running after that
+        '''
+        self._finished.wait(timeout)
+        return self.returncode
+
+    def result(self, timeout=None):
+        '''
+        Wait until the job is finished and return *callback(self)*, or
+        *returncode* if no callback given.
+        '''
+        self.wait(timeout)
+        if self.callback is None:
+            return self.returncode
+        return self.callback(self)
+
+    def cancel(self):
+        '''
+        Cancel the job: if queued it does not run, if running the process is
+        killed.
+
+        @return: True if the job was not finished before
+        '''
+        with self._lock:
+            if self.done():
+                return False
+            self._kill('cancelled')
+            if self.status == 'queued':
+                self.status = 'cancelled'
+                self._finished.set()
+            return True
+
+    def _kill(self, status):
+        if self._process is not None and self.status == 'running':
+            self.status = status
+            try:
+                self._process.kill()
+            except OSError:
+                # already exited
+                pass
+
+    def _run(self):
+        with self._lock:
+            if self.status != 'queued':
+                return
+            self.status = 'running'
+            stdin = None if self.input is None else subprocess.PIPE
+            if self.capture:
+                out = subprocess.PIPE
+            else:
+                out = open(self.stdout or os.devnull, 'w')
+            try:
+                with open(os.devnull, 'w') as fnull:
+                    self._process = subprocess.Popen(self.args, stdin=stdin,
+                                                     stdout=out, stderr=fnull)
+            except OSError:
+                self.status = 'done'
+                self._finished.set()
+                raise
+            finally:
+                if not self.capture:
+                    out.close()
+        timer = None
+        if self.timeout is not None:
+            timer = threading.Timer(self.timeout, self._on_timeout)
+            timer.daemon = True
+            timer.start()
+        try:
+            output, _ = self._process.communicate(self.input)
+        except IOError:
+            # killed before reading all the input
+            output = None
+        returncode = self._process.wait()
+        if self.capture:
+            self.output = output
+            if self.stdout is not None and output is not None:
+                with open(self.stdout, 'w') as f_out:
+                    f_out.write(output)
+        if timer is not None:
+            timer.cancel()
+            timer.join()
+        with self._lock:
+            if self.status == 'running':
+                self.status = 'done'
+                self.returncode = returncode
+            self._finished.set()
+
+    def _on_timeout(self):
+        with self._lock:
+            self._kill('timeout')
+
+class ProverPool(object):
+    '''
+    Queue of jobs run by *processes* worker threads, one subprocess per
+    worker at a time. Call shutdown when the pool is not needed any more.
+    '''
+
+    def __init__(self, processes=None):
+        '''
+        Constructor
+
+        @param processes: number of jobs running at once, number of CPUs by
+        default but at least 2, so that Prover9 and Mace4 can run together
+        '''
+        if processes is None:
+            processes = max(2, multiprocessing.cpu_count())
+        self.processes = processes
+        self._queue = Queue.Queue()
+        self._workers = []
+        for _ in xrange(processes):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, args, stdout=None, timeout=None, callback=None,
+               input=None, capture=False):
+        '''
+        Put job in the queue, see Job for the parameters.
+
+        @return: Job
+        '''
+        job = Job(args, stdout, timeout, callback, input, capture)
+        self._queue.put(job)
+        return job
+
+    def shutdown(self, wait=True):
+        '''
+        Stop the workers after the jobs already submitted.
+        '''
+        for _ in self._workers:
+            self._queue.put(None)
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            try:
+                job._run()
+            except OSError:
+                # program not found, job is finished with returncode None
+                pass
+
+_default_pool = None
+
+def default_pool():
+    '''
+    Return pool shared by the module-level prover functions, created on first
+    use with the default size of ProverPool, see set_pool_size.
+    '''
+    global _default_pool
+    if _default_pool is None:
+        _default_pool = ProverPool()
+    return _default_pool
+
+def set_pool_size(processes):
+    '''
+    Replace default pool with the pool of *processes* workers. Jobs submitted
+    to the old pool are finished.
+    '''
+    global _default_pool
+    if _default_pool is not None:
+        _default_pool.shutdown(wait=False)
+    _default_pool = ProverPool(processes)
+
+@atexit.register
+def _shutdown_default_pool():
+    if _default_pool is not None:
+        _default_pool.shutdown()
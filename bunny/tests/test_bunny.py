@@ -5,7 +5,8 @@ Created on Apr 28, 2013
 
 @author: artem
 '''
-from nose.tools import nottest, raises
+from nose.tools import nottest, raises, assert_raises
+import itertools
 import sympy
 
 import fca
@@ -181,7 +182,48 @@ class TestPFunc:
         f = bunny.bunny.PiecewiseFunc('f', graph)
         f.size = None
         assert f('n+0', 'm+0') == bunny.bunny.Value(5)
-        
+
+    def test_affine_solver(self):
+        systems = [[('n+1', 'n1+0')], [('m+n+0', 'n1+3')],
+                   [('n+0', 'n1+0'), ('n+0', 3)], [('2*n+0', 'n1+0')],
+                   [('m+0', 2), ('n-1', 'm1+0')], [('m-n+0', 'm1-2')]]
+        for eq_system in systems:
+            solution = sympy.solve([sympy.Eq(sympy.sympify(lhs),
+                                             sympy.sympify(rhs))
+                                    for lhs, rhs in eq_system], ['n', 'm'])
+            fast = bunny.bunny._solve_affine(eq_system)
+            if fast is bunny.bunny._not_affine:
+                assert eq_system == [('2*n+0', 'n1+0')]
+            elif fast is None:
+                assert solution == []
+            else:
+                assert fast == dict(
+                    (str(sym), bunny.bunny._affine(str(form)))
+                    for sym, form in solution.items())
+        val = bunny.bunny.Value
+        f = bunny.bunny.PiecewiseFunc('f', [(val('m+n+0'), val(1),
+                                             val('m-n+2'))])
+        assert f('n+3', 1) == '2*m-n-1'
+        assert f(7, 1) == '2*m-5'
+        f = bunny.bunny.PiecewiseFunc('f', [(val('2*n+0'), val('n+0'))])
+        assert f('n+0') == 'n/2'
+
+    def test_index(self):
+        var = bunny.bunny.Variable()
+        out = bunny.bunny.Variable()
+        f = bunny.bunny.PiecewiseFunc('f', [], size=2)
+        f.add_value((bunny.bunny.Value(0), var), out)
+        assert f(0, var) is out
+        var.value = 'n+0'
+        out.value = 'n+1'
+        assert f(0, 'n+0') == 'n+1'
+        assert f(0, 5) == 6
+        other = bunny.bunny.Variable()
+        f.add_value((bunny.bunny.Value(1), bunny.bunny.Value(1)), other)
+        assert f(1, 1) is other
+        other.identify(out)
+        assert f(1, 1) == 'n+1'
+
 def test_consistency():
     val = bunny.bunny.Value
     f2_graph = [(val(0), val('n'), val('n-1')), (val(0), val(0), val(0)),
@@ -221,6 +263,112 @@ class TestBunny:
         assert bunny.bunny._index(b.funcs['f2'].dict,
                                   b.funcs['f1'].dict,
                                   b.funcs['f0'], 3) == ind
+        
+    def test_compact(self):
+        compact = bunny.bunny.bunnies(2, compact=True)
+        for b, cb in zip(bunny.bunny.bunnies(2), compact):
+            assert b.index == cb.index
+            assert str(b) == str(cb)
+            assert b.check_id(self.id1) == cb.check_id(self.id1)
+            assert b.check_id(self.id2) == cb.check_id(self.id2)
+        cb = bunny.bunny.CompactBunny.dicts2bunny(self.bunny.funcs['f2'].dict,
+                                                  self.bunny.funcs['f1'].dict,
+                                                  0)
+        assert cb.index == self.bunny.index
+        assert cb == bunny.bunny.show(self.bunny.index, 2, compact=True)
+        assert not hasattr(cb, '__dict__')
+        assert cb.funcs is cb.funcs
+        
+    def test_odometer(self):
+        odo = bunny.bunny.TableOdometer(2)
+        prev = None
+        for index, b in itertools.izip_longest(odo, bunny.bunny.bunnies(2)):
+            assert index == b.index
+            assert odo.f1_table == [b.funcs['f1'](i) for i in range(2)]
+            assert odo.f2_table == [b.funcs['f2'](k % 2, k / 2)
+                                    for k in range(4)]
+            if prev:
+                changed = ([('f1', i) for i in range(2)
+                            if prev[0][i] != odo.f1_table[i]] +
+                           [('f2', k) for k in range(4)
+                            if prev[1][k] != odo.f2_table[k]])
+                assert changed == odo.changed
+            prev = (odo.f1_table[:], odo.f2_table[:])
+        
+    def test_incremental_checker(self):
+        ids = [self.id1, self.id2,
+               bunny.identity.Identity.func_str2id('f2(x,y) = f2(y,x)'),
+               bunny.identity.Identity.func_str2id('f0 = f1(f1(f0))')]
+        odo = bunny.bunny.TableOdometer(2)
+        checker = bunny.bunny.IncrementalChecker(odo, ids)
+        for index, b in itertools.izip(odo, bunny.bunny.bunnies(2)):
+            checker.update()
+            assert checker.row() == [b.check_id(id_) for id_ in ids]
+        
+    def test_row_filler(self):
+        f2s = bunny.identity.Identity.func_str2id
+        ids = [f2s('x = y'), f2s('f2(x,y) = f2(y,x)'), f2s('f2(y,x) = f2(x,y)'),
+               f2s('f0 = f1(f1(f0))'), f2s('f2(x,f0) = f2(f0,x)')]
+        imps = [([ids[1]], [ids[4]])] + bunny.identity.known_implications(ids)
+        filler = bunny.bunny.RowFiller(ids, imps)
+        for b in bunny.bunny.bunnies(2):
+            assert filler.fill(b) == [b.check_id(id_) for id_ in ids]
+        assert filler.evaluations < 64 * len(ids)
+        # x = y is cheap in small bunnies and expensive in big ones
+        assert filler.order(2).index(0) < filler.order(5).index(0)
+        assert filler.order(5) is filler.order(5)
+        
+    def test_witness_cache(self):
+        cache = bunny.bunny.witness_cache
+        cache.clear()
+        id_ = bunny.identity.Identity.func_str2id('f2(x,y) = f2(y,x)')
+        rows = [b.check_id(id_) for b in bunny.bunny.bunnies(2)]
+        assert cache.hits > 0
+        assert len(cache.get(id_)) <= cache.maxsize
+        cache.clear()
+        assert cache.hits == 0 and cache.get(id_) == ()
+        assert rows == [b.check_id(id_, vectorized=True)
+                        for b in bunny.bunny.bunnies(2)]
+        # witnesses of an identity do not leak to one with the same number
+        id2 = bunny.identity.Identity.func_str2id(
+            'f2(x,f2(y,z)) = f2(f2(x,y),z)')
+        id2._number = id_.number
+        [b.check_id(id_) for b in bunny.bunny.bunnies(2)]
+        assert ([b.check_id(id2) for b in bunny.bunny.bunnies(2)] ==
+                [b.check_id(id2, vectorized=True)
+                 for b in bunny.bunny.bunnies(2)])
+        
+    def test_canonical_index(self):
+        reps = [b.index for b in
+                itertools.islice(bunny.bunny.bunnies(3, up_to_iso=True), 3000)]
+        assert len(set(bunny.bunny.canonical_index(bunny.bunny.show(i, 3))
+                       for i in reps)) == len(reps)
+        p = (3, 0, 4, 1, 2)
+        for index in (5, 1000, 77777, 5**30 - 1):
+            b = bunny.bunny.show(index, 5)
+            f2_dict = dict(((p[i], p[j]), p[b.funcs['f2'](i, j)])
+                           for i in range(5) for j in range(5))
+            f1_dict = dict((p[i], p[b.funcs['f1'](i)]) for i in range(5))
+            iso = bunny.bunny.Bunny.dicts2bunny(f2_dict, f1_dict, p[0])
+            assert (bunny.bunny.canonical_index(iso) ==
+                    bunny.bunny.canonical_index(b))
+        # all the elements but f0 alike
+        b = bunny.bunny.show(0, 10)
+        assert_raises(ValueError, bunny.bunny.canonical_index, b)
+            
+    def test_up_to_iso(self):
+        assert ([b.index for b in bunny.bunny.bunnies(2, up_to_iso=True)] ==
+                [b.index for b in bunny.bunny.bunnies(2)])
+        p = (0, 2, 1)
+        seen = set()
+        for b in itertools.islice(bunny.bunny.bunnies(3, up_to_iso=True), 300):
+            f2_dict = dict(((p[i], p[j]), p[b.funcs['f2'](i, j)])
+                           for i in range(3) for j in range(3))
+            f1_dict = dict((p[i], p[b.funcs['f1'](i)]) for i in range(3))
+            iso_index = bunny.bunny._index(f2_dict, f1_dict, 0, 3)
+            assert b.index <= iso_index
+            assert not iso_index in seen
+            seen.add(b.index)
 
 class TestInfBunny():
     
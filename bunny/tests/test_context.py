@@ -0,0 +1,30 @@
+'''
+Use with Nosetests (https://nose.readthedocs.org/en/latest/)
+'''
+import numpy as np
+
+from bunny.context import BitContext
+
+def test_closure():
+    table = [[True, True, False],
+             [True, False, True],
+             [True, True, True]]
+    cxt = BitContext.from_table(table, ['o1', 'o2', 'o3'], ['a', 'b', 'c'])
+    assert cxt.rows == [3, 5, 7]
+    assert cxt.columns == [7, 5, 6]
+    assert cxt.extent(cxt.attrs2bits(['b'])) == 5
+    assert cxt.bits2attrs(cxt.closure(cxt.attrs2bits(['b', 'c']))) == \
+           ['a', 'b', 'c']
+    assert cxt.closure(0) == cxt.attrs2bits(['a'])
+    assert cxt.holds(cxt.attrs2bits(['c']), cxt.attrs2bits(['a']))
+    assert not cxt.holds(cxt.attrs2bits(['c']), cxt.attrs2bits(['b']))
+    assert cxt.table() == table
+
+def test_packed():
+    table = np.random.RandomState(0).rand(20, 11) < 0.5
+    cxt = BitContext.from_table(table, range(20), range(11))
+    packed = np.packbits(table, axis=1)
+    assert (cxt.packed() == packed).all()
+    assert BitContext.from_packed(packed, range(20), range(11)).rows == \
+           cxt.rows
+    assert BitContext(cxt.rows, range(20), range(11)).columns == cxt.columns
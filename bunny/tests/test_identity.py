@@ -5,7 +5,13 @@ Created on Apr 28, 2013
 
 @author: artem
 '''
-import bunny.bunny
+import hashlib
+import imp
+import os
+import shutil
+import tempfile
+
+import bunny.bunny, bunny.identity, bunny.vectorized
 from bunny.identity import *
 
 def test_make_identity():
@@ -30,7 +36,21 @@ def test_str2term():
     assert t1.func_str == 'x'
     assert t2.func_str == 'f1(f2(x,f0))'
     assert t3.func_str == 'f2(f2(f0,f1(x)),f1(y))'
-    
+
+def test_parse_term():
+    assert Term.str2term('(x*y)*(z*w)').func_str == 'f2(f2(x,y),f2(z,w))'
+    assert Term.str2term('x*y*-z').func_str == 'f2(f2(x,y),f1(z))'
+    assert Term.str2term('f2(a, -x)').func_str == 'f2(f0,f1(x))'
+    assert Term.str2term('(x)').func_str == 'x'
+    assert Term.str2term('f2( x ,(y))').func_str == 'f2(x,y)'
+    assert parse_term('f2(f0,f1(x))') == ('f2', 'f0', ('f1', 'x'))
+    for str_ in ['x*', '(x', 'f2(x)', 'x)', 'q']:
+        try:
+            parse_term(str_)
+            assert False
+        except ParseError:
+            pass
+
 def test_evaluate_term():
     f2_dict = {(0, 0): 0, (1, 0): 1}
     f1_dict = {0: 1, 1: 2}
@@ -49,4 +69,101 @@ def test_generate_ts():
     # term_parser.parse_str('a*[-x]') := ('a*[-x]', 2, 3, [0, 0], [2, 3, 1], [0, 2, 1])
     t0 = Term.str2term('a*(-x)')
     assert (t0 in generate_ts(4))
-    assert (t0 not in generate_ts(2))
\ No newline at end of file
+    assert (t0 not in generate_ts(2))
+    
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache.get('a') == 1
+    cache['c'] = 3
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats() == {'size': 2, 'maxsize': 2, 'hits': 3,
+                             'misses': 1, 'evictions': 1}
+    
+def test_term_cache():
+    bun = bunny.bunny.show(50, 2)
+    t = Term.str2term('-(x*a)')
+    term_cache.clear()
+    assert t(bun, {'x': 1}) == t(bun, {'x': 1, 'y': 0})
+    assert term_cache.hits == 1 and term_cache.misses == 1
+    # wrong index given, values still of its own tables
+    other = bunny.bunny.show(51, 2)
+    wrong = bunny.bunny.Bunny(other.funcs['f2'], other.funcs['f1'], 0, 50)
+    t = Term.str2term('x*a')
+    assert t(bun, {'x': 0}) == 0
+    assert t(wrong, {'x': 0}) == t(other, {'x': 0}) == 1
+    compact = bunny.bunny.show(50, 2, compact=True)
+    assert compact.tables_key() == bun.tables_key()
+    
+def test_canonical_key():
+    id1 = Identity.func_str2id('f2(y,x) = f1(y)')
+    id2 = Identity.func_str2id('f1(z) = f2(z,w)')
+    id3 = Identity.func_str2id('f2(x,y) = f1(y)')
+    assert id1.canonical_key == id2.canonical_key
+    assert id1.canonical_key != id3.canonical_key
+    
+def test_generate_ts_distinct():
+    ts = map(str, generate_ts(4, 2))
+    assert len(ts) == len(set(ts)) == 30
+    assert ts == map(str, generate_ts(4, 2, lazy=True))
+    
+def test_term_dag():
+    ids = map(Identity.func_str2id, ['x = f1(f2(x,f0))', 'f0 = f2(x,f0)',
+                                     'f1(f0) = f1(f2(x,f0))'])
+    dag = TermDAG(ids)
+    # x, f0, f2(x,f0), f1(f2(x,f0)), f1(f0)
+    assert len(dag.nodes) == 5
+    for index in (0, 17, 50, 63):
+        bun = bunny.bunny.show(index, 2)
+        assert (bunny.vectorized.check_ids(bun, dag) ==
+                [bun.check_id(id_) for id_ in ids])
+
+def test_read_ids_cache():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'ids.txt')
+        with open(path, 'w') as f_ids:
+            f_ids.write('x = y\nf2(x,y) = f1(f0)\n')
+        ids1 = read_ids(path)
+        assert os.path.exists(path + '.cache')
+        ids2 = read_ids(path)
+        assert map(str, ids1) == map(str, ids2)
+        assert ids2[1].var_symbols == set(['x', 'y'])
+        assert ids2[1].func_symbols == ['f2', 'f1', 'f0']
+        with open(path, 'a') as f_ids:
+            f_ids.write('f1(x) = x\n')
+        assert map(str, read_ids(path))[2] == 'f1(x) = x'
+        # cache written by another interpreter is not used
+        with open(path, 'rb') as f_ids:
+            digest = hashlib.sha1(f_ids.read()).hexdigest()
+        cache_path = path + '.cache'
+        assert bunny.identity._read_ids_cache(cache_path, digest) is not None
+        get_magic = imp.get_magic
+        imp.get_magic = lambda: get_magic()[::-1]
+        try:
+            assert bunny.identity._read_ids_cache(cache_path, digest) is None
+            assert map(str, read_ids(path)) == map(str, read_ids(path, False))
+            assert bunny.identity._read_ids_cache(cache_path,
+                                                  digest) is not None
+        finally:
+            imp.get_magic = get_magic
+        assert bunny.identity._read_ids_cache(cache_path, digest) is None
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def test_registry():
+    reg = IdentityRegistry()
+    id1 = Identity.func_str2id('f2(x,y) = f2(y,x)')
+    id2 = Identity.func_str2id('x = f1(f1(x))')
+    assert reg.intern(id1) == 0 and reg.intern(id2) == 1
+    assert reg.intern(Identity.func_str2id('f2(x,y) = f2(y,x)')) == 0
+    assert reg.lookup('x = f1(f1(x))') is id2
+    assert reg.lookup('f0 = f1(f0)') is reg[2]
+    assert reg.ids2bits([id2, 'f0 = f1(f0)']) == 6
+    assert reg.bits2ids(5) == [id1, reg[2]]
+    # numbers of identities come from the global registry only
+    number = id2.number
+    IdentityRegistry().intern(id2)
+    assert id2.number == number == registry.intern(id2)
@@ -5,11 +5,14 @@ Created on Jul 29, 2014
 
 @author: artreven
 '''
+import distutils.spawn
 import os
 import sys
+import threading
 
 import fca
-import bunny.identity, bunny.p9m4, bunny.bunny
+import nose
+import bunny.identity, bunny.p9m4, bunny.bunny, bunny.prover_cache
 
 class Test:
 
@@ -30,8 +33,112 @@ class Test:
         pass
 
     def test_prove1(self):
-        assert not bunny.p9m4.mace4(self.imp1, self.cwd + r'/prove1', wait_time=1)[0]
+        assert not bunny.p9m4.mace4(self.imp1, wait_time=1)[0]
         
     def test_ce1(self):
         assert bunny.p9m4.mace4(self.imp2, self.cwd + r'/ce1', wait_time=1)[0]
-        os.remove(self.cwd + r'/ce1.mace4.out')
\ No newline at end of file
+        os.remove(self.cwd + r'/ce1.in')
+        os.remove(self.cwd + r'/ce1.mace4.out')
+
+def _imp(premise, conclusion):
+    return fca.Implication(set(map(bunny.identity.Identity.str2id, premise)),
+                           set(map(bunny.identity.Identity.str2id,
+                                   conclusion)))
+
+def test_race():
+    if (distutils.spawn.find_executable('mace4') is None or
+        distutils.spawn.find_executable('prover9') is None):
+        raise nose.SkipTest('Prover9 and Mace4 are not installed')
+    imp = _imp
+    imp1 = imp(['-x = y*z', 'x = x'], ['-x = -(-x)'])
+    imp2 = imp(['a = -(a*a)', 'a = a*(-a)', 'x = -(x*a)', 'a = -(-a)',
+                'x = -(x*x)', 'a = x*(-a)', '-x = a*x', '-a = a*a', 'x = x'],
+               ['a = x*(-x)', 'x = (-x)*a'])
+    stopped = threading.Event()
+    def contender(stop):
+        # runs until the race is decided
+        stop.wait(30)
+        if stop.is_set():
+            stopped.set()
+        return None, 'stopped'
+    proved, ce, reason = bunny.p9m4.race(imp2, 1, contenders=[contender])
+    assert not proved and ce
+    assert stopped.wait(5)
+    proved, ce, reason = bunny.p9m4.race(imp1, 1)
+    assert proved and not ce
+
+def test_race_contenders():
+    # provers are answered from the cache, so no binaries are run
+    imp = _imp(['x = f2(x,x)'], ['f2(x,y) = f2(y,x)'])
+    model = bunny.bunny.show(6, 2)
+    def stopped_contender(stopped):
+        def contender(stop):
+            # runs until the race is decided
+            stop.wait(30)
+            if stop.is_set():
+                stopped.set()
+            return None, 'stopped'
+        return contender
+    cache = bunny.prover_cache.ProverCache(':memory:')
+    cache.put('prover9', imp, 1, 'timeout')
+    cache.put('mace4', imp, 1, 'timeout')
+    stopped = threading.Event()
+    proved, ce, reason = bunny.p9m4.race(
+        imp, 1, cache=cache,
+        contenders=[lambda stop: (model, 'found'),
+                    stopped_contender(stopped)])
+    assert not proved and ce is model and reason == 'found'
+    assert stopped.wait(5)
+    cache.put('mace4', imp, 1, 'model', model)
+    stopped = threading.Event()
+    proved, ce, reason = bunny.p9m4.race(
+        imp, 1, cache=cache, contenders=[stopped_contender(stopped)])
+    assert not proved and ce == model
+    assert stopped.wait(5)
+    cache.put('prover9', imp, 1, 'proved')
+    proved, ce, reason = bunny.p9m4.race(imp, 1, cache=cache)
+    assert proved and ce is None
+
+def test_iter_models():
+    out = ['interpretation( 2, [number=1, seconds=0], [\n',
+           '        function(f0, [ 1 ]),\n',
+           '        function(f1(_), [ 1, 0 ]),\n',
+           '        function(f2(_,_), [\n',
+           '\t\t\t   0, 1,\n',
+           '\t\t\t   1, 1 ])\n',
+           ']).\n',
+           'interpretation( 10, [number=2, seconds=0], [\n',
+           '        function(f1(_), [ 9, 8, 7, 6, 5, 4, 3, 2, 1, 0 ])\n',
+           ']).\n']
+    bun1, bun2 = bunny.p9m4.iter_models(out)
+    assert bun1.index == 1*2 + 1*2**2 + 1*2**3 + (1 + 0*2)*2**4 + 1*2**6
+    assert bun1 == bunny.bunny.show(bun1.index, 2)
+    assert bun2.size == 10 and bun2.funcs['f1'](0) == 9
+    assert bun2 == bunny.bunny.show(bun2.index, 10)
+
+def test_iter_models_surface():
+    out = ['interpretation( 2, [number=1, seconds=0], [\n',
+           '        function(a, [ 1 ]),\n',
+           '        function(c1, [ 0 ]),\n',
+           '        function(-(_), [ 1, 0 ]),\n',
+           '        function(*(_,_), [\n',
+           '\t\t\t   0, 1,\n',
+           '\t\t\t   1, 1 ])\n',
+           ']).\n']
+    bun, = bunny.p9m4.iter_models(out)
+    assert bun.index == 1*2 + 1*2**2 + 1*2**3 + (1 + 0*2)*2**4 + 1*2**6
+    assert bun == bunny.bunny.show(bun.index, 2)
+    for line in ['        function(g(_,_), [ 0, 0, 0, 0 ]),\n',
+                 '        function(b, [ 0 ]),\n']:
+        try:
+            list(bunny.p9m4.iter_models(out[:1] + [line] + out[1:]))
+            assert False
+        except ValueError:
+            pass
+
+def test_unique_models():
+    b1 = bunny.bunny.show(86, 2)
+    # b1 with 0 and 1 swapped
+    b2 = bunny.bunny.show(25, 2)
+    assert bunny.p9m4.unique_models([b1, b2, b1]) == [b1, b2]
+    assert bunny.p9m4.unique_models([b1, b2], up_to_iso=True) == [b1]
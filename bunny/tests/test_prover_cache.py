@@ -0,0 +1,35 @@
+'''
+Use with Nosetests (https://nose.readthedocs.org/en/latest/)
+'''
+import bunny.bunny
+from bunny.prover_cache import ProverCache, canonical_imp
+
+class Imp(object):
+    def __init__(self, premise, conclusion):
+        self.premise = premise
+        self.conclusion = conclusion
+
+def test_canonical_imp():
+    imp1 = Imp(['f2(x,y) = f2(y,x)', 'x = f1(f1(x))'], ['f0 = f1(f0)'])
+    imp2 = Imp(['y = f1(f1(y))', 'f2(y,x) = f2(x,y)'], ['f1(f0) = f0'])
+    assert canonical_imp(imp1) == canonical_imp(imp2)
+    assert canonical_imp(imp1) != canonical_imp(Imp(imp1.conclusion,
+                                                    imp1.premise))
+
+def test_cache():
+    cache = ProverCache(':memory:')
+    imp = Imp(['x = f1(f1(x))'], ['f2(x,y) = f2(y,x)'])
+    assert cache.get('prover9', imp, 1) is None
+    cache.put('prover9', imp, 1, 'timeout')
+    assert cache.get('prover9', imp, 0.5) == ('timeout', None)
+    assert cache.get('prover9', imp, 2) is None
+    cache.put('prover9', imp, 0.5, 'timeout')
+    assert cache.get('prover9', imp, 1) == ('timeout', None)
+    bun = bunny.bunny.show(index=37, size=2)
+    cache.put('mace4', imp, 1, 'model', bun)
+    status, model = cache.get('mace4', imp, 10)
+    assert status == 'model' and model == bun
+    cache.put('mace4', imp, 5, 'timeout')
+    assert cache.get('mace4', imp, 10)[0] == 'model'
+    assert cache.hits == 4 and cache.misses == 2
+    cache.close()
@@ -0,0 +1,42 @@
+'''
+Use with Nosetests (https://nose.readthedocs.org/en/latest/)
+'''
+import os
+import tempfile
+import time
+
+from bunny.prover_pool import ProverPool
+
+def test_jobs():
+    pool = ProverPool(2)
+    out = tempfile.mktemp()
+    try:
+        job1 = pool.submit(['sh', '-c', 'echo proved; exit 3'], stdout=out)
+        job2 = pool.submit(['sleep', '10'], timeout=0.2)
+        assert job1.wait() == 3 and job1.status == 'done'
+        with open(out) as f_out:
+            assert f_out.read() == 'proved\n'
+        assert job2.wait() is None and job2.status == 'timeout'
+        job3 = pool.submit(['true'], callback=lambda job: job.returncode + 1)
+        assert job3.result() == 1
+    finally:
+        pool.shutdown()
+        os.remove(out)
+
+def test_pipes():
+    pool = ProverPool(1)
+    job = pool.submit(['cat'], input='formulas(goals).\n', capture=True)
+    assert job.wait() == 0 and job.output == 'formulas(goals).\n'
+    pool.shutdown()
+
+def test_cancel():
+    pool = ProverPool(1)
+    running = pool.submit(['sleep', '10'])
+    queued = pool.submit(['true'])
+    time.sleep(0.1)
+    start = time.time()
+    assert queued.cancel() and running.cancel()
+    assert running.wait(5) is None and running.status == 'cancelled'
+    assert queued.status == 'cancelled' and queued.wait() is None
+    assert time.time() - start < 5
+    pool.shutdown()
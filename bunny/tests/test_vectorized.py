@@ -0,0 +1,29 @@
+'''
+Use with Nosetests (https://nose.readthedocs.org/en/latest/)
+'''
+import bunny.bunny, bunny.vectorized
+from bunny.identity import Identity
+
+def test_check_id_vectorized():
+    id_strs = ['x = y', 'f0 = f1(f0)', 'x = f2(f0,f1(x))',
+               'f2(x,y) = f2(y,x)', 'f2(x,f2(y,z)) = f2(f2(x,y),z)']
+    ids = map(Identity.func_str2id, id_strs)
+    for bun in bunny.bunny.bunnies(2):
+        for id_ in ids:
+            assert (bun.check_id(id_, v=True) ==
+                    bun.check_id(id_, v=True, vectorized=True))
+            assert (bun.check_id(id_) ==
+                    bun.check_id(id_, vectorized=True))
+
+def test_satisfaction_matrix():
+    id_strs = ['x = x', 'x = f1(f1(x))', 'f0 = f2(x,f0)', 'f2(x,y) = f2(y,x)']
+    ids = map(Identity.func_str2id, id_strs)
+    buns = list(bunny.bunny.bunnies(2))
+    indices, tables = next(bunny.vectorized.table_batches(2, 100))
+    assert list(indices) == [bun.index for bun in buns]
+    matrix = bunny.vectorized.satisfaction_matrix(tables, ids)
+    assert matrix.shape == (len(buns), len(ids))
+    for bun, row in zip(buns, matrix):
+        assert list(row) == [bun.check_id(id_) for id_ in ids]
+    packed = bunny.vectorized.satisfaction_matrix(tables, ids, packed=True)
+    assert packed.shape == (len(buns), 1)
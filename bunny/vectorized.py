@@ -0,0 +1,168 @@
+"""
+Holds NumPy based evaluation of terms and identities in finite bunnies.
+
+Functions f2 and f1 are kept as Cayley tables and a term is evaluated over the
+whole grid of assignments at once: every variable is an open grid along its
+own axis and every application of a function is a fancy-index gather.
+"""
+import numpy as np
+
+import identity
+
+def cayley_tables(bun):
+    """
+    Return Cayley tables of finite bunny *bun* as (f2, f1, f0), where f2 is a
+    size x size array with f2[i, j] = f2(i, j), f1 is an array of length size
+    and f0 is an int.
+    """
+    size = bun.size
+    if hasattr(bun, 'f2_table'):
+        # CompactBunny, f2(i, j) is stored at position i + size*j
+        f2 = np.frombuffer(bun.f2_table, dtype=np.uint8).reshape(size, size)
+        f1 = np.frombuffer(bun.f1_table, dtype=np.uint8)
+        return f2.T.astype(np.intp), f1.astype(np.intp), int(bun.f0)
+    f2_dict = bun.funcs['f2'].dict
+    f1_dict = bun.funcs['f1'].dict
+    f2 = np.array([[f2_dict[i, j] for j in xrange(size)]
+                   for i in xrange(size)], dtype=np.intp)
+    f1 = np.array([f1_dict[i] for i in xrange(size)], dtype=np.intp)
+    return f2, f1, int(bun.funcs['f0'])
+
+def var_grids(var_ls, size):
+    """
+    Return dict of open grids for variables in *var_ls*: i-th variable varies
+    along i-th axis.
+    """
+    n = len(var_ls)
+    grids = dict()
+    for axis, var in enumerate(var_ls):
+        shape = [1] * n
+        shape[axis] = size
+        grids[var] = np.arange(size, dtype=np.intp).reshape(shape)
+    return grids
+
+def eval_term(term, tables, grids):
+    """
+    Evaluate *term* on all the assignments given by *grids* at once.
+
+    @param tables: (f2, f1, f0) as returned by cayley_tables
+    @return: array broadcastable to the shape of the grid
+    """
+    f2, f1, f0 = tables
+    eval_dict = dict(grids)
+    eval_dict['f2'] = lambda a, b: f2[a, b]
+    eval_dict['f1'] = lambda a: f1[a]
+    eval_dict['f0'] = f0
+    return np.asarray(eval(term.compiled_str, globals(), eval_dict))
+
+def check_ids(bun, dag, tables=None):
+    """
+    Check all the identities of TermDAG *dag* in finite bunny *bun*.
+
+    @return: list of bools
+    """
+    if tables is None:
+        tables = cayley_tables(bun)
+    return dag.check(*tables)
+
+def check_id(bun, id_, v=False, tables=None):
+    """
+    Vectorized version of Bunny.check_id for finite bunnies. Gives the same
+    answer, the failing assignment (if *v*) is the first one in the order of
+    itertools.product.
+    """
+    if tables is None:
+        tables = cayley_tables(bun)
+    var_ls = list(id_.var_symbols)
+    grids = var_grids(var_ls, bun.size)
+    lhs = eval_term(id_.left_term, tables, grids)
+    rhs = eval_term(id_.right_term, tables, grids)
+    shape = (bun.size,) * len(var_ls)
+    eq = np.broadcast_to(lhs == rhs, shape)
+    if eq.all():
+        return True
+    if not v:
+        return False
+    pos = np.unravel_index(np.argmin(eq), shape)
+    dict_subs = dict(zip(var_ls, map(int, pos)))
+    lhs = int(np.broadcast_to(lhs, shape)[pos])
+    rhs = int(np.broadcast_to(rhs, shape)[pos])
+    return False, dict_subs, lhs, rhs
+
+################################BATCHES OF BUNNIES
+def stack_tables(buns):
+    """
+    Stack Cayley tables of finite bunnies of the same size into arrays of
+    shapes (n, size, size), (n, size), (n,).
+    """
+    tables = [cayley_tables(bun) for bun in buns]
+    f2 = np.array([t[0] for t in tables], dtype=np.intp)
+    f1 = np.array([t[1] for t in tables], dtype=np.intp)
+    f0 = np.array([t[2] for t in tables], dtype=np.intp)
+    return f2, f1, f0
+
+def table_batches(size, batch_size, start=0, stop=None):
+    """
+    Create iterator over batches of bunnies from *bunnies(size)* without
+    creating Bunny objects. Bunnies are addressed by their position in
+    *bunnies(size)*, positions from *start* to *stop* are covered.
+
+    @return: iterator over (indices, (f2, f1, f0)), where indices is an array
+    of bunny indices and (f2, f1, f0) are stacked tables as in stack_tables.
+    @attention: positions and indices are int64, so sizes up to 4 only.
+    """
+    n1 = size ** size
+    n2 = size ** (size**2)
+    if stop is None:
+        stop = n2 * n1
+    f2_pows = np.array([[size ** (i + size*j) for j in xrange(size)]
+                        for i in xrange(size)], dtype=np.int64)
+    f1_pows = np.array([size ** i for i in xrange(size)], dtype=np.int64)
+    for begin in xrange(start, stop, batch_size):
+        pos = np.arange(begin, min(begin + batch_size, stop), dtype=np.int64)
+        v2 = pos // n1
+        v1 = pos % n1
+        f2 = (v2[:, None, None] // f2_pows) % size
+        f1 = (v1[:, None] // f1_pows) % size
+        f0 = np.zeros(len(pos), dtype=np.intp)
+        indices = v2 + v1 * n2
+        yield indices, (f2.astype(np.intp), f1.astype(np.intp), f0)
+
+def satisfaction_matrix(tables, id_ls, packed=False, dag=None):
+    """
+    Compute relation between a batch of bunnies of the same size and
+    identities: entry (i, j) is True iff i-th bunny satisfies j-th identity.
+    Subterms shared by identities are evaluated once, see identity.TermDAG.
+
+    @param tables: (f2, f1, f0) as returned by stack_tables or table_batches
+    @param packed: if True return the rows packed into bits by np.packbits
+    @param dag: TermDAG of *id_ls* to reuse between batches
+    @return: boolean array of shape (bunnies, identities)
+    """
+    if dag is None:
+        dag = identity.TermDAG(id_ls)
+    matrix = dag.check(*tables)
+    if packed:
+        return np.packbits(matrix, axis=1)
+    return matrix
+
+def distinct_rows(size, id_ls, batch_size, start=0, stop=None):
+    """
+    Compute rows of the bunnies from *bunnies(size)* at positions from *start*
+    to *stop*, keep only the first bunny for every distinct row.
+
+    @return: (indices, rows), rows are packed by np.packbits and are str
+    """
+    indices = []
+    rows = []
+    seen = set()
+    dag = identity.TermDAG(id_ls)
+    for batch_indices, tables in table_batches(size, batch_size, start, stop):
+        packed = satisfaction_matrix(tables, id_ls, packed=True, dag=dag)
+        for index, row in zip(batch_indices, packed):
+            row = row.tostring()
+            if not row in seen:
+                seen.add(row)
+                indices.append(int(index))
+                rows.append(row)
+    return indices, rows